@@ -0,0 +1,131 @@
+import os
+import json
+import hashlib
+import time
+import uuid
+import threading
+
+# Stage-level checkpoints: each pipeline stage persists its output under a run ID,
+# so a failed run can be resumed without redoing (and re-paying for) finished stages.
+#
+# Layout: <CHECKPOINT_DIR>/<user hash>/<run_id>.json          inputs + stage outputs
+#                                     /<run_id>.status.json   inputs + stage statuses only,
+#                                                             so listing never reads the outputs
+#
+# Env:
+#   CHECKPOINT_DIR  where run files are kept (default: .runs)
+
+STAGES = [
+    "extract",
+    "generate-docs", "create-doc", "share-doc",
+    "generate-slides", "create-slides", "share-slides",
+    "email",
+]
+
+DONE = "done"
+FAILED = "failed"
+
+
+def checkpoint_dir():
+    return os.getenv("CHECKPOINT_DIR", ".runs")
+
+
+def user_dir(user_id, base_dir=None):
+    """Directory holding one user's runs (hashed, so emails don't end up in paths)."""
+    user_hash = hashlib.sha1(str(user_id).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(base_dir or checkpoint_dir(), user_hash)
+
+
+class RunCheckpoint:
+    """One pipeline run on disk: its inputs plus the status/output of every stage."""
+
+    def __init__(self, run_id, data, base_dir=None):
+        self.run_id = run_id
+        self.data = data
+        run_dir = user_dir(data["inputs"].get("user_id"), base_dir)
+        self.path = os.path.join(run_dir, f"{run_id}.json")
+        self.status_path = os.path.join(run_dir, f"{run_id}.status.json")
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, inputs, base_dir=None):
+        """Starts a new run. `inputs` must be JSON-serializable (form values, emails, ...) and include user_id."""
+        run_id = time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        ckpt = cls(run_id, {"run_id": run_id, "created_at": time.time(), "inputs": inputs, "stages": {}}, base_dir)
+        ckpt.save()
+        return ckpt
+
+    @classmethod
+    def load(cls, run_id, user_id, base_dir=None):
+        """Returns `user_id`'s run, or None if they have no checkpoint for `run_id`."""
+        path = os.path.join(user_dir(user_id, base_dir), f"{run_id}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return cls(run_id, json.load(f), base_dir)
+
+    @property
+    def inputs(self):
+        return self.data["inputs"]
+
+    def status(self, stage):
+        return self.data["stages"].get(stage, {}).get("status")
+
+    def is_done(self, stage):
+        return self.status(stage) == DONE
+
+    def output(self, stage):
+        return self.data["stages"].get(stage, {}).get("output")
+
+    def mark_done(self, stage, output=None):
+        self._update(stage, {"status": DONE, "output": output, "error": None})
+
+    def mark_failed(self, stage, error, output=None):
+        """`output` keeps partial progress (e.g. emails already sent) for the next attempt."""
+        self._update(stage, {"status": FAILED, "output": output, "error": str(error)})
+
+    def pending_stages(self, stages):
+        """Stages (of those selected for this run) that are failed or never ran."""
+        return [stage for stage in stages if not self.is_done(stage)]
+
+    def _update(self, stage, record):
+        with self._lock:
+            record["updated_at"] = time.time()
+            self.data["stages"][stage] = record
+        self.save()
+
+    def save(self):
+        """Write-then-rename so a crash never leaves a half-written checkpoint."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock:
+            status = {
+                "run_id": self.run_id,
+                "created_at": self.data["created_at"],
+                "inputs": self.data["inputs"],
+                "stages": {stage: record["status"] for stage, record in self.data["stages"].items()},
+            }
+            for path, data in ((self.path, self.data), (self.status_path, status)):
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, path)
+
+
+def list_runs(user_id, base_dir=None):
+    """
+    `user_id`'s runs, most recent first, as status summaries
+    ({"run_id", "created_at", "inputs", "stages": {stage: status}}) — stage outputs aren't read.
+    """
+    run_dir = user_dir(user_id, base_dir)
+    if not os.path.isdir(run_dir):
+        return []
+    runs = []
+    for name in sorted(os.listdir(run_dir), reverse=True):
+        if not name.endswith(".status.json"):
+            continue
+        try:
+            with open(os.path.join(run_dir, name), encoding="utf-8") as f:
+                runs.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # being replaced right now; picked up on the next listing
+    return runs
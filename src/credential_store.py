@@ -0,0 +1,147 @@
+import os
+import hashlib
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl  # POSIX only; on Windows we fall back to in-process locking
+except ImportError:
+    fcntl = None
+
+# Pluggable storage for Google OAuth tokens, keyed by user identity.
+# Replaces the single shared token.json so concurrent sessions don't race on one file.
+#
+# Env:
+#   CREDENTIAL_STORE     "sqlite" (default) or "file" (legacy single-user token.json)
+#   CREDENTIAL_DB_PATH   SQLite database path (default: .credentials.db)
+
+
+class CredentialStore:
+    """
+    Base class. Subclasses store the authorized-user JSON (`creds.to_json()`) per user.
+    user_id must be a verified identity (see google_utils.get_google_creds).
+    """
+
+    # True if every user_id maps to the same token (legacy token.json)
+    single_user = False
+
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+        self._thread_locks = {}
+        self._guard = threading.Lock()
+
+    def load(self, user_id):
+        """Returns the stored token JSON string, or None."""
+        raise NotImplementedError
+
+    def save(self, user_id, token_json):
+        raise NotImplementedError
+
+    def delete(self, user_id):
+        raise NotImplementedError
+
+    @contextmanager
+    def lock(self, user_id):
+        """
+        Exclusive lock for one user across threads *and* processes (one lock file per user,
+        so refreshes for different users don't block each other).
+        Hold it while refreshing so only one session rotates the token.
+        """
+        with self._guard:
+            thread_lock = self._thread_locks.setdefault(user_id, threading.Lock())
+        with thread_lock:
+            if fcntl is None:
+                yield
+                return
+            user_hash = hashlib.sha1(str(user_id).encode("utf-8")).hexdigest()[:16]
+            with open(f"{self.lock_path}.{user_hash}", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class SQLiteCredentialStore(CredentialStore):
+    """Local multi-user store. One row per user; SQLite handles concurrent readers."""
+
+    def __init__(self, db_path=".credentials.db"):
+        super().__init__(db_path + ".lock")
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS account_tokens ("
+                "user_id TEXT PRIMARY KEY, token_json TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:  # commits on success, rolls back on error
+                yield conn
+        finally:
+            conn.close()
+
+    def load(self, user_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT token_json FROM account_tokens WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def save(self, user_id, token_json):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO account_tokens (user_id, token_json, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET token_json = excluded.token_json, updated_at = excluded.updated_at",
+                (user_id, token_json, time.time())
+            )
+
+    def delete(self, user_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM account_tokens WHERE user_id = ?", (user_id,))
+
+
+class FileCredentialStore(CredentialStore):
+    """Legacy behaviour: a single token.json shared by every user (single-user deployments only)."""
+
+    single_user = True
+
+    def __init__(self, path="token.json"):
+        super().__init__(path + ".lock")
+        self.path = path
+
+    def load(self, user_id):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            return f.read()
+
+    def save(self, user_id, token_json):
+        # Write-then-rename so a concurrent reader never sees a half-written file
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(token_json)
+        os.replace(tmp_path, self.path)
+
+    def delete(self, user_id):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_credential_store():
+    """Returns the process-wide credential store selected by CREDENTIAL_STORE."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            kind = os.getenv("CREDENTIAL_STORE", "sqlite").lower()
+            if kind == "file":
+                _store = FileCredentialStore()
+            else:
+                _store = SQLiteCredentialStore(os.getenv("CREDENTIAL_DB_PATH", ".credentials.db"))
+        return _store
@@ -6,3 +6,26 @@ class LLMGenerationError(Exception):
     def __init__(self, message):
         self.message = message
         super().__init__(self.message)
+
+class StageError(Exception):
+    """
+    Raised when a pipeline stage finishes without a usable result
+    (e.g. the Google API returned no link). The stage is checkpointed as failed,
+    keeping 'output' as partial progress (e.g. emails already sent).
+    """
+    def __init__(self, message, output=None):
+        self.message = message
+        self.output = output
+        super().__init__(self.message)
+
+class SlidesBatchError(Exception):
+    """
+    Raised when a presentation was created but some of its text batches still failed
+    after retries. The deck is kept: 'presentation_id' and 'pending_batches' let the
+    caller resend only the failed batches instead of creating a second deck.
+    """
+    def __init__(self, message, presentation_id, pending_batches):
+        self.message = message
+        self.presentation_id = presentation_id
+        self.pending_batches = pending_batches
+        super().__init__(self.message)
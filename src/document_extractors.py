@@ -0,0 +1,195 @@
+import io
+import os
+import re
+import zipfile
+import hashlib
+from html.parser import HTMLParser
+from xml.etree import ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from llm_helper import extract_text_from_pdf, normalize_text, estimate_tokens
+from profiling import profile_worker
+
+# Pluggable text extraction for assignment documents (spec PDF, rubric, slides, templates...).
+# Add a format with:
+#
+#     @register_extractor(".ext")
+#     def extract_ext(data):  # bytes -> str, raise on failure
+#         ...
+#
+# Env:
+#   EXTRACTION_WORKERS    parallel extraction threads (default: 4)
+#   PROMPT_TOKEN_BUDGET   max tokens of merged assignment text sent to the LLM (default: 24000)
+
+EXTRACTORS = {}
+
+
+def register_extractor(*extensions):
+    def decorator(fn):
+        for ext in extensions:
+            EXTRACTORS[ext.lower()] = fn
+        return fn
+    return decorator
+
+
+def supported_types():
+    """Extensions for st.file_uploader(type=...)."""
+    return sorted(ext.lstrip(".") for ext in EXTRACTORS)
+
+
+@register_extractor(".pdf")
+def extract_pdf(data):
+    text = extract_text_from_pdf(io.BytesIO(data))
+    # extract_text_from_pdf reports failures in-band
+    if text.startswith("Error reading PDF:"):
+        raise ValueError(text)
+    return text
+
+
+def _xml_text(xml_bytes, paragraph_tag, text_tag):
+    """Joins the text runs of every paragraph in an OOXML part (namespace-agnostic)."""
+    paragraphs = []
+    for element in ElementTree.fromstring(xml_bytes).iter():
+        if element.tag.endswith("}" + paragraph_tag):
+            runs = [node.text or "" for node in element.iter() if node.tag.endswith("}" + text_tag)]
+            paragraphs.append("".join(runs))
+    return "\n".join(paragraphs)
+
+
+@register_extractor(".docx")
+def extract_docx(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        return _xml_text(archive.read("word/document.xml"), "p", "t")
+
+
+@register_extractor(".pptx")
+def extract_pptx(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        slide_names = [n for n in archive.namelist() if re.fullmatch(r"ppt/slides/slide\d+\.xml", n)]
+        slide_names.sort(key=lambda n: int(re.search(r"(\d+)\.xml$", n).group(1)))
+        slides = [_xml_text(archive.read(name), "p", "t") for name in slide_names]
+    return "\n\n".join(f"[Slide {i}]\n{text}" for i, text in enumerate(slides, start=1))
+
+
+@register_extractor(".txt", ".md")
+def extract_plain_text(data):
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return data.decode("big5", errors="replace")
+
+
+class _HTMLTextParser(HTMLParser):
+    BLOCK_TAGS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "section", "article"}
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self._skip:
+            self._skip -= 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+@register_extractor(".html", ".htm")
+def extract_html(data):
+    parser = _HTMLTextParser()
+    parser.feed(extract_plain_text(data))
+    return "".join(parser.parts)
+
+
+def extract_document(name, data):
+    """
+    Extracts one file with the extractor registered for its extension.
+    Returns: {"name", "text", "tokens", "error"} — never raises.
+    """
+    ext = os.path.splitext(name)[1].lower()
+    extractor = EXTRACTORS.get(ext)
+    if extractor is None:
+        return {"name": name, "text": "", "tokens": 0, "error": f"Unsupported file type: {ext or name}"}
+    try:
+        text = normalize_text(extractor(data))
+    except Exception as e:
+        return {"name": name, "text": "", "tokens": 0, "error": str(e)}
+    return {"name": name, "text": text, "tokens": estimate_tokens(text), "error": None}
+
+
+def extract_documents(files, max_workers=None):
+    """Extracts [(name, bytes), ...] in parallel; results keep the input order."""
+    if not files:
+        return []
+    max_workers = max_workers or int(os.getenv("EXTRACTION_WORKERS", "4"))
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(files)), thread_name_prefix="extract") as pool:
+        return list(pool.map(profile_worker(lambda f: extract_document(*f)), files))
+
+
+# Lines shorter than this (bullets, page numbers, "Yes") are too generic to count as duplicates
+DEDUP_MIN_CHARS = 20
+
+
+def _line_key(line):
+    """Whitespace/case-normalized hash of a line, or None if it's too short to dedup."""
+    normalized = re.sub(r"\s+", " ", line).strip().lower()
+    if len(normalized) < DEDUP_MIN_CHARS:
+        return None
+    return hashlib.sha1(normalized.encode()).hexdigest()
+
+
+def merge_documents(documents, token_budget=None):
+    """
+    Merges extracted documents into one labelled corpus for the prompt:
+    - each source gets a "=== [Source: name] ===" header
+    - lines already seen in any source are dropped (pypdf and the OOXML extractors put a
+      single "\n" between paragraphs, so a line is the unit compared)
+    - if the result exceeds `token_budget`, it is shared fairly: sources that fit their
+      share are kept whole, and only the larger ones are truncated to an equal share
+    Returns: (merged_text, tokens)
+    """
+    token_budget = token_budget or int(os.getenv("PROMPT_TOKEN_BUDGET", "24000"))
+    seen = set()
+    sections = []
+    for doc in documents:
+        if not doc["text"]:
+            continue
+        lines = []
+        for line in doc["text"].split("\n"):
+            key = _line_key(line)
+            if key:
+                if key in seen:
+                    continue
+                seen.add(key)
+            lines.append(line)
+        text = re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+        if text:
+            sections.append((doc["name"], text))
+
+    tokens = [estimate_tokens(text) for _, text in sections]
+    if sum(tokens) > token_budget:
+        # Smallest first: each source that fits its share hands the rest of it to the larger ones
+        caps = {}
+        remaining = token_budget
+        order = sorted(range(len(sections)), key=lambda i: tokens[i])
+        for n, i in enumerate(order):
+            caps[i] = min(tokens[i], remaining / (len(order) - n))
+            remaining -= caps[i]
+        trimmed = []
+        for i, (name, text) in enumerate(sections):
+            if caps[i] < tokens[i]:
+                text = text[:int(len(text) * caps[i] / tokens[i])].rstrip() + "\n…(truncated)"
+            trimmed.append((name, text))
+        sections = trimmed
+
+    merged = "\n\n".join(f"=== [Source: {name}] ===\n{text}" for name, text in sections)
+    return merged, estimate_tokens(merged)
@@ -2,27 +2,116 @@ import os
 import json
 import base64
 import re  # Added for robust JSON parsing
+import threading
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from email.mime.text import MIMEText
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+from google.auth.transport.requests import Request, AuthorizedSession
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
 import streamlit as st
+from rate_limiter import execute
+from profiling import profile_worker
+from credential_store import get_credential_store
+from custom_exceptions import SlidesBatchError
 
 # Fixes Issue #9: Downgraded 'drive' to 'drive.file' for security and easier verification
 SCOPES = [
     'https://www.googleapis.com/auth/gmail.send',
     'https://www.googleapis.com/auth/drive.file',
     'https://www.googleapis.com/auth/documents',
-    'https://www.googleapis.com/auth/presentations'
+    'https://www.googleapis.com/auth/presentations',
+    # Identity of the authorizing account, so tokens are stored under a verified email
+    'openid',
+    'https://www.googleapis.com/auth/userinfo.email'
 ]
+USERINFO_URL = "https://openidconnect.googleapis.com/v1/userinfo"
 
-def get_google_creds():
+# 🟢 In-memory cache of refreshed credentials, keyed by verified identity
+_creds_cache = {}
+_creds_cache_lock = threading.Lock()
+
+def get_account_email(creds):
+    """Email of the Google account that authorized `creds`, as reported by Google (never user input)."""
+    response = AuthorizedSession(creds).get(USERINFO_URL, timeout=30)
+    response.raise_for_status()
+    info = response.json()
+    if not info.get("email") or not info.get("email_verified"):
+        raise ValueError("Google account has no verified email")
+    return info["email"].strip().lower()
+
+def _load_stored_creds(user_id, store):
+    """Loads credentials for `user_id` from the credential store (None if missing/corrupt)."""
+    token_json = store.load(user_id)
+    if not token_json:
+        return None
+    try:
+        return Credentials.from_authorized_user_info(json.loads(token_json), SCOPES)
+    except Exception as e:
+        st.warning(f"⚠️ Corrupt stored token for {user_id}. You may need to re-login. Error: {e}")
+        return None
+
+def _refresh_creds(user_id, creds, store):
     """
-    Retrieves Google Cloud credentials using a sustainable hierarchy.
-    (Code from previous fix - no changes here)
+    Refreshes under the per-user lock so concurrent sessions don't all rotate the token.
+    Whoever gets the lock second picks up the token the first one saved.
     """
+    with store.lock(user_id):
+        stored = _load_stored_creds(user_id, store)
+        if stored and stored.valid:
+            return stored
+        creds.refresh(Request())
+        store.save(user_id, creds.to_json())
+        return creds
+
+def _run_consent_flow(user_id, store):
+    """
+    Runs the OAuth consent flow and saves the token under `user_id` (verified login)
+    or, without one, the email Google reports for the authorizing account.
+    Returns: (creds, user_id), or (None, None) on failure.
+    """
+    if not os.path.exists('credentials.json'):
+        st.error("❌ 'credentials.json' not found. Please download it from Google Cloud Console and place it in the root directory.")
+        return None, None
+
+    try:
+        flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
+        creds = flow.run_local_server(port=0)
+        # 🟢 Key on the account that actually authorized (or the signed-in Streamlit user)
+        user_id = user_id or get_account_email(creds)
+        store.save(user_id, creds.to_json())
+        return creds, user_id
+    except Exception as e:
+        st.error(f"❌ Authentication failed: {e}")
+        return None, None
+
+def get_google_creds(user_id=None, store=None):
+    """
+    Retrieves Google Cloud credentials using a sustainable hierarchy:
+    st.secrets -> in-memory cache -> credential store (per user) -> OAuth flow.
+
+    user_id must be a verified identity (Streamlit login, or the account this session
+    already authorized) — never something the user typed. Without one, stored tokens are
+    not looked up (except the single-user token.json store) and the OAuth flow runs;
+    its token is saved under the email Google reports for the authorizing account.
+    Returns: (creds, user_id) — user_id is the verified key the creds are stored under
+    (None for the shared st.secrets account when there is no login).
+    """
+    store = store or get_credential_store()
+
+    if user_id:
+        with _creds_cache_lock:
+            creds = _creds_cache.get(user_id)
+        if creds and creds.valid:
+            return creds, user_id
+
     creds = None
+    from_secrets = False
     try:
         if "google_oauth" in st.secrets:
             try:
@@ -30,193 +119,338 @@ def get_google_creds():
                     info=st.secrets["google_oauth"], 
                     scopes=SCOPES
                 )
+                # One deployment-wide account: it says nothing about who this session is,
+                # so without a login no user_id is returned (callers keep such sessions apart)
+                from_secrets = True
             except Exception as e:
                 st.error(f"⚠️ Error loading credentials from secrets: {e}")
     except Exception:
         pass
 
-    if not creds and os.path.exists('token.json'):
-        try:
-            creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-        except Exception as e:
-            st.warning(f"⚠️ Corrupt token.json found. You may need to re-login. Error: {e}")
+    # The single-user store holds one token regardless of key; its owner is checked below
+    store_key = user_id or ("default" if store.single_user else None)
+    if not creds and store_key:
+        creds = _load_stored_creds(store_key, store)
 
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             try:
-                creds.refresh(Request())
+                if from_secrets:
+                    creds.refresh(Request())
+                else:
+                    creds = _refresh_creds(store_key, creds, store)
             except Exception as e:
                 st.error(f"❌ Session expired and refresh failed: {e}")
                 creds = None
 
         if not creds:
-            if not os.path.exists('credentials.json'):
-                st.error("❌ 'credentials.json' not found. Please download it from Google Cloud Console and place it in the root directory.")
-                return None
-            
-            try:
-                flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-                creds = flow.run_local_server(port=0)
-                with open('token.json', 'w') as token:
-                    token.write(creds.to_json())
-            except Exception as e:
-                st.error(f"❌ Authentication failed: {e}")
-                return None
+            creds, user_id = _run_consent_flow(user_id, store)
+            if not creds:
+                return None, None
+
+    if from_secrets and not user_id:
+        return creds, None
+
+    if not user_id:
+        try:
+            user_id = get_account_email(creds)
+        except Exception as e:
+            # e.g. a legacy token.json granted before the identity scopes existed: ask again
+            print(f"⚠️ Stored token can't be verified ({e}); re-running the consent flow")
+            creds, user_id = _run_consent_flow(None, store)
+            if not creds:
+                return None, None
 
-    return creds
+    with _creds_cache_lock:
+        _creds_cache[user_id] = creds
+    return creds, user_id
 
-def get_google_service():
-    """Builds and returns the Google Workspace service objects."""
-    creds = get_google_creds()
-    if not creds: return None, None, None, None
+def get_google_service(user_id=None):
+    """
+    Builds and returns the Google Workspace service objects, plus the verified user_id
+    (see get_google_creds): ((gmail, drive, docs, slides), user_id), or (None, None).
+    All four services share one authorized HTTP transport, so the caller can keep
+    the tuple (e.g. in st.session_state) and reuse its connections across reruns.
+    """
+    creds, user_id = get_google_creds(user_id)
+    if not creds: return None, None
     try:
-        return (
-            build('gmail', 'v1', credentials=creds),
-            build('drive', 'v3', credentials=creds),
-            build('docs', 'v1', credentials=creds),
-            build('slides', 'v1', credentials=creds) 
+        http = AuthorizedHttp(creds, http=httplib2.Http(timeout=120))
+        services = (
+            build('gmail', 'v1', http=http, cache_discovery=False),
+            build('drive', 'v3', http=http, cache_discovery=False),
+            build('docs', 'v1', http=http, cache_discovery=False),
+            build('slides', 'v1', http=http, cache_discovery=False) 
         )
+        return services, user_id
     except Exception as e:
         st.error(f"❌ Failed to connect to Google Services: {e}")
-        return None, None, None, None
+        return None, None
 
 def create_doc_with_content(service_docs, service_drive, title, content):
     """建立 Google Doc 並寫入 LLM 產生的內容"""
     try:
-        doc = service_docs.documents().create(body={'title': title}).execute()
+        doc = execute(service_docs.documents().create(body={'title': title}), 'docs')
         doc_id = doc.get('documentId')
         requests = [{'insertText': {'location': {'index': 1}, 'text': content}}]
-        service_docs.documents().batchUpdate(documentId=doc_id, body={'requests': requests}).execute()
-        file_info = service_drive.files().get(fileId=doc_id, fields='webViewLink').execute()
+        execute(service_docs.documents().batchUpdate(documentId=doc_id, body={'requests': requests}), 'docs')
+        file_info = execute(service_drive.files().get(fileId=doc_id, fields='webViewLink'), 'drive')
         return doc_id, file_info.get('webViewLink')
     except Exception as e:
         st.error(f"建立文件失敗: {e}")
         return None, None
 
-def create_slides_presentation(service_slides, service_drive, title, json_content):
+def parse_slides_json(json_content):
     """
-    Create Google Slides with robust JSON parsing.
+    Robust JSON parsing of the LLM's slide outline.
     Fixes Issue #10: Uses Regex to extract JSON array from messy LLM output.
+    Raises: json.JSONDecodeError
     """
-    slides_data = []
-    try:
-        # 🟢 Robust Parsing Logic (Fixes Issue #10)
-        # 1. Try to find a JSON array pattern [ ... ]
-        match = re.search(r'\[.*\]', json_content, re.DOTALL)
-        
-        if match:
-            json_str = match.group(0)
-            slides_data = json.loads(json_str)
-        else:
-            # Fallback: Try cleaning just the markdown tags if regex fails
-            clean_json = json_content.replace("```json", "").replace("```", "").strip()
-            slides_data = json.loads(clean_json)
-            
-    except json.JSONDecodeError as e:
-        return None, f"❌ JSON Parsing Failed: {str(e)} \n(Content: {json_content[:100]}...)"
+    # 1. Try to find a JSON array pattern [ ... ]
+    match = re.search(r'\[.*\]', json_content, re.DOTALL)
+    if match:
+        return json.loads(match.group(0))
+    # Fallback: Try cleaning just the markdown tags if regex fails
+    clean_json = json_content.replace("```json", "").replace("```", "").strip()
+    return json.loads(clean_json)
 
-    try:
-        # B. 建立簡報 (Create Presentation)
-        body = {'title': title}
-        presentation = service_slides.presentations().create(body=body).execute()
-        presentation_id = presentation.get('presentationId')
-        default_slide_id = presentation.get('slides')[0].get('objectId')
-        
-        requests = []
-        
-        for i, slide in enumerate(slides_data):
-            slide_id = f"gen_slide_{i}"
-            
-            # --- Cover Slide ---
-            if i == 0:
-                layout = 'TITLE' 
-                title_id = f"gen_title_{i}"
-                subtitle_id = f"gen_subtitle_{i}"
-                
-                requests.append({
-                    'createSlide': {
-                        'objectId': slide_id,
-                        'slideLayoutReference': {'predefinedLayout': layout},
-                        'placeholderIdMappings': [
-                            {'layoutPlaceholder': {'type': 'CENTERED_TITLE', 'index': 0}, 'objectId': title_id},
-                            {'layoutPlaceholder': {'type': 'SUBTITLE', 'index': 0}, 'objectId': subtitle_id}
-                        ]
-                    }
-                })
-                
-                slide_title = slide.get('title', title)
-                slide_subtitle = slide.get('subtitle', slide.get('points', ''))
-                
-                if slide_title:
-                    requests.append({'insertText': {'objectId': title_id, 'text': slide_title}})
-                    requests.append({
-                        'updateTextStyle': {
-                            'objectId': title_id,
-                            'style': {'fontSize': {'magnitude': 42, 'unit': 'PT'}},
-                            'fields': 'fontSize'
-                        }
-                    })
-
-                if slide_subtitle:
-                    requests.append({'insertText': {'objectId': subtitle_id, 'text': str(slide_subtitle)}})
-            
-            # --- Content Slides ---
-            else:
-                layout = 'TITLE_AND_BODY'
-                title_id = f"gen_title_{i}"
-                body_id = f"gen_body_{i}"
-
-                requests.append({
-                    'createSlide': {
-                        'objectId': slide_id,
-                        'slideLayoutReference': {'predefinedLayout': layout},
-                        'placeholderIdMappings': [
-                            {'layoutPlaceholder': {'type': 'TITLE', 'index': 0}, 'objectId': title_id},
-                            {'layoutPlaceholder': {'type': 'BODY', 'index': 0}, 'objectId': body_id}
-                        ]
+def compile_slide_requests(slides_data, title):
+    """
+    Compiles the whole deck in one pass, before any presentation exists.
+    Returns: (creation_requests, text_groups)
+      creation_requests - createSlide for every slide (in deck order); the caller appends the
+                          deleteObject for the new deck's default slide
+      text_groups       - one list of insertText/updateTextStyle per slide; groups touch disjoint
+                          objects, so they can be sent in any order once the slides exist
+    """
+    creation_requests = []
+    text_groups = []
+
+    for i, slide in enumerate(slides_data):
+        slide_id = f"gen_slide_{i}"
+        title_id = f"gen_title_{i}"
+        texts = []
+
+        # --- Cover Slide ---
+        if i == 0:
+            body_id = f"gen_subtitle_{i}"
+            creation_requests.append({
+                'createSlide': {
+                    'objectId': slide_id,
+                    'slideLayoutReference': {'predefinedLayout': 'TITLE'},
+                    'placeholderIdMappings': [
+                        {'layoutPlaceholder': {'type': 'CENTERED_TITLE', 'index': 0}, 'objectId': title_id},
+                        {'layoutPlaceholder': {'type': 'SUBTITLE', 'index': 0}, 'objectId': body_id}
+                    ]
+                }
+            })
+
+            slide_title = slide.get('title', title)
+            slide_subtitle = slide.get('subtitle', slide.get('points', ''))
+
+            if slide_title:
+                texts.append({'insertText': {'objectId': title_id, 'text': slide_title}})
+                texts.append({
+                    'updateTextStyle': {
+                        'objectId': title_id,
+                        'style': {'fontSize': {'magnitude': 42, 'unit': 'PT'}},
+                        'fields': 'fontSize'
                     }
                 })
+            if slide_subtitle:
+                texts.append({'insertText': {'objectId': body_id, 'text': str(slide_subtitle)}})
 
-                if 'title' in slide and slide['title']:
-                     requests.append({'insertText': {'objectId': title_id, 'text': slide['title']}})
-                
-                content_text = slide.get('points', '')
-                if isinstance(content_text, list):
-                    content_text = "\n".join([f"• {item}" for item in content_text])
-                
-                if content_text:
-                    requests.append({'insertText': {'objectId': body_id, 'text': str(content_text)}})
+        # --- Content Slides ---
+        else:
+            body_id = f"gen_body_{i}"
+            creation_requests.append({
+                'createSlide': {
+                    'objectId': slide_id,
+                    'slideLayoutReference': {'predefinedLayout': 'TITLE_AND_BODY'},
+                    'placeholderIdMappings': [
+                        {'layoutPlaceholder': {'type': 'TITLE', 'index': 0}, 'objectId': title_id},
+                        {'layoutPlaceholder': {'type': 'BODY', 'index': 0}, 'objectId': body_id}
+                    ]
+                }
+            })
 
-        # Delete default blank slide
-        if requests:
-            requests.append({'deleteObject': {'objectId': default_slide_id}})
+            if 'title' in slide and slide['title']:
+                texts.append({'insertText': {'objectId': title_id, 'text': slide['title']}})
+
+            content_text = slide.get('points', '')
+            if isinstance(content_text, list):
+                content_text = "\n".join([f"• {item}" for item in content_text])
+            if content_text:
+                texts.append({'insertText': {'objectId': body_id, 'text': str(content_text)}})
 
-        # Execute Batch Update
-        if requests:
-            service_slides.presentations().batchUpdate(
+        if texts:
+            text_groups.append(texts)
+
+    return creation_requests, text_groups
+
+def chunk_requests(groups, max_requests=None, max_bytes=None):
+    """
+    Packs request groups into batches bounded by request count and JSON payload size.
+    A group is never split across batches (unless it alone exceeds the limits).
+    """
+    max_requests = max_requests or int(os.getenv("SLIDES_BATCH_MAX_REQUESTS", "100"))
+    max_bytes = max_bytes or int(os.getenv("SLIDES_BATCH_MAX_BYTES", str(512 * 1024)))
+    batches = []
+    current, current_bytes = [], 0
+    for group in groups:
+        group_bytes = sum(len(json.dumps(r, ensure_ascii=False).encode()) for r in group)
+        if current and (len(current) + len(group) > max_requests or current_bytes + group_bytes > max_bytes):
+            batches.append(current)
+            current, current_bytes = [], 0
+        current = current + group
+        current_bytes += group_bytes
+    if current:
+        batches.append(current)
+    return batches
+
+# Statuses where Slides rejected the whole batch without applying it, so it can be resent
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+def _send_slides_batch(service_slides, presentation_id, batch, http=None, retries=None):
+    """
+    batchUpdate with per-batch retries, only for RETRYABLE_STATUSES. After a timeout or a
+    dropped connection the batch may already be applied, and resending its insertText
+    requests would duplicate the text, so those errors are raised as is.
+    """
+    retries = retries or int(os.getenv("SLIDES_BATCH_RETRIES", "3"))
+    kwargs = {'http': http} if http else {}
+    for attempt in range(retries):
+        try:
+            return execute(service_slides.presentations().batchUpdate(
                 presentationId=presentation_id, 
-                body={'requests': requests}
-            ).execute()
-            
-        file_info = service_drive.files().get(fileId=presentation_id, fields='webViewLink').execute()
-        return presentation_id, file_info.get('webViewLink')
+                body={'requests': batch}
+            ), 'slides', **kwargs)
+        except HttpError as e:
+            if e.resp.status not in RETRYABLE_STATUSES or attempt == retries - 1:
+                raise
+            print(f"⚠️ Slides batch attempt {attempt + 1} failed: {e}. Retrying...")
+            time.sleep(2 ** attempt)
 
+def _delete_presentation(service_drive, presentation_id):
+    """Best-effort cleanup of a deck that can't be completed."""
+    try:
+        execute(service_drive.files().delete(fileId=presentation_id), 'drive')
     except Exception as e:
+        print(f"⚠️ Could not delete partial presentation {presentation_id}: {e}")
+
+def create_slides_presentation(service_slides, service_drive, title, json_content, progress=None, resume=None):
+    """
+    Create Google Slides from the LLM's JSON outline.
+    Requests are compiled once, sent as size-bounded batches (slide creation first, in order,
+    then text batches in parallel), each batch retried on its own.
+    progress: optional callback(done_batches, total_batches, label), called from the caller's thread.
+    resume: {"presentation_id", "pending_batches"} from a SlidesBatchError — only those batches
+            are resent, into the existing deck.
+    Raises: SlidesBatchError if text batches still fail after retries (the deck is kept for resume).
+    If slide creation itself fails, the partial deck is deleted and (None, error) returned.
+    """
+    if resume:
+        presentation_id = resume["presentation_id"]
+        creation_batches, text_batches = [], resume["pending_batches"]
+    else:
+        try:
+            slides_data = parse_slides_json(json_content)
+        except json.JSONDecodeError as e:
+            return None, f"❌ JSON Parsing Failed: {str(e)} \n(Content: {json_content[:100]}...)"
+
+        # A bad outline is rejected here, before a deck exists that would need cleaning up
+        try:
+            creation_requests, text_groups = compile_slide_requests(slides_data, title)
+        except Exception as e:
+            return None, f"Invalid slide outline: {e}"
+
+        try:
+            # B. 建立簡報 (Create Presentation)
+            body = {'title': title}
+            presentation = execute(service_slides.presentations().create(body=body), 'slides')
+            presentation_id = presentation.get('presentationId')
+            default_slide_id = presentation.get('slides')[0].get('objectId')
+        except Exception as e:
+            return None, str(e)
+
+        # Delete default blank slide
+        if creation_requests:
+            creation_requests.append({'deleteObject': {'objectId': default_slide_id}})
+        creation_batches = chunk_requests([[r] for r in creation_requests])
+        text_batches = chunk_requests(text_groups)
+
+    total = len(creation_batches) + len(text_batches)
+    done = 0
+
+    # 1. Slide creation: sequential, so the deck order is preserved
+    try:
+        for batch in creation_batches:
+            _send_slides_batch(service_slides, presentation_id, batch)
+            done += 1
+            if progress: progress(done, total, "建立投影片")
+    except Exception as e:
+        # A half-built deck can't be resumed batch by batch; don't leave it behind
+        _delete_presentation(service_drive, presentation_id)
         return None, str(e)
 
+    # 2. Text batches: independent of each other -> parallel.
+    # httplib2 isn't thread-safe, so each worker gets its own authorized transport.
+    creds = getattr(getattr(service_slides, '_http', None), 'credentials', None)
+    workers = int(os.getenv("SLIDES_BATCH_WORKERS", "4")) if creds else 1
+    local = threading.local()
+
+    def send(batch):
+        http = None
+        if workers > 1:
+            if not hasattr(local, 'http'):
+                local.http = AuthorizedHttp(creds, http=httplib2.Http(timeout=120))
+            http = local.http
+        return _send_slides_batch(service_slides, presentation_id, batch, http=http)
+
+    failed_batches = []
+    first_error = None
+    if text_batches:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(text_batches))), thread_name_prefix="slides") as pool:
+            # copy_context: workers charge the same user's rate limit as the caller
+            futures = {pool.submit(contextvars.copy_context().run, profile_worker(send), batch): batch for batch in text_batches}
+            for future in as_completed(futures):
+                if future.exception():
+                    failed_batches.append(futures[future])
+                    first_error = first_error or str(future.exception())
+                done += 1
+                if progress: progress(done, total, "寫入內容")
+
+    if failed_batches:
+        raise SlidesBatchError(
+            f"{len(failed_batches)}/{len(text_batches)} text batches failed: {first_error}",
+            presentation_id, failed_batches
+        )
+
+    try:
+        file_info = execute(service_drive.files().get(fileId=presentation_id, fields='webViewLink'), 'drive')
+    except Exception as e:
+        raise SlidesBatchError(f"Presentation built, but its link could not be fetched: {e}", presentation_id, [])
+    return presentation_id, file_info.get('webViewLink')
+
 def share_file_permissions(service_drive, file_id, emails):
-    """Share file permissions (Writer)"""
+    """
+    Share file permissions (Writer)
+    Returns: list of (email, error) that could not be shared.
+    """
+    failed_list = []
     for email in emails:
         user_permission = {'type': 'user', 'role': 'writer', 'emailAddress': email.strip()}
         try:
-            service_drive.permissions().create(
+            execute(service_drive.permissions().create(
                 fileId=file_id,
                 body=user_permission,
                 fields='id',
                 sendNotificationEmail=False
-            ).execute()
+            ), 'drive')
         except Exception as e:
             st.warning(f"⚠️ Unable to share with {email}: {e}")
+            failed_list.append((email, str(e)))
+    return failed_list
 
 def send_gmail(service_gmail, to_emails, subject, content):
     """Send Email to members"""
@@ -229,7 +463,7 @@ def send_gmail(service_gmail, to_emails, subject, content):
             message['subject'] = subject
             raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
             body = {'raw': raw}
-            service_gmail.users().messages().send(userId='me', body=body).execute()
+            execute(service_gmail.users().messages().send(userId='me', body=body), 'gmail')
             success_list.append(email)
         except Exception as e:
             failed_list.append((email, str(e)))
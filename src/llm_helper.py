@@ -1,23 +1,23 @@
 import os
 import json
+import re
 import time  # Added for retry delay
 import requests
 from dotenv import load_dotenv
 from pathlib import Path
 from custom_exceptions import LLMGenerationError
+from rate_limiter import get_limiter
 
 # 1. Load .env
 current_dir = Path(__file__).parent
 env_path = current_dir.parent / '.env'
 load_dotenv(dotenv_path=env_path, override=True)
 
-def generate_project_plan(course_name, members, assignment_text, current_date, due_date, output_format="Docs", retries=3):
+def get_llm_config():
     """
-    Calls LLM API to generate project plan with automatic retries.
-    Raises: LLMGenerationError on failure after all retries.
+    Resolves provider, model, endpoint and headers from the environment.
+    Returns: (provider, model_name, api_url, headers)
     """
-    
-    # --- Configuration ---
     provider = os.getenv("LLM_PROVIDER", "ncku").lower()
     api_key = os.getenv("API_KEY", "")
     
@@ -47,60 +47,99 @@ def generate_project_plan(course_name, members, assignment_text, current_date, d
         if not api_url: api_url = "https://api-gateway.netdb.csie.ncku.edu.tw/api/chat"
         headers["Authorization"] = f"Bearer {api_key}"
 
-    # --- Prompt Construction ---
+    return provider, model_name, api_url, headers
+
+def build_prompt(course_name, members, assignment_text, current_date, due_date, output_format="Docs"):
+    """
+    Builds the prompt as <shared context> + <format-specific instructions>.
+    🟢 The context (incl. the long assignment text) is byte-identical for Docs and Slides,
+    so the server can reuse its prompt/KV cache for the second call.
+    """
+    context = f"""You are a professional Project Manager.
+[Course]: {course_name}
+[Members]: {members}
+[Assignment]: {assignment_text}
+[Date]: Today is {current_date}, Due is {due_date}.
+"""
+
     if output_format == "Slides":
-            # (JSON Prompt - Unchanged)
-            prompt = f"""
-            You are a Project Manager.
-            [Course]: {course_name}
-            [Members]: {members}
-            [Assignment]: {assignment_text}
-            [Date]: Today is {current_date}, Due is {due_date}.
-            
-            Please generate a "Google Slides Outline" for this project.
-            
-            【STRICT FORMAT REQUIREMENTS】:
-            1. Output a valid JSON Array.
-            2. **First Slide (Cover)** must contain "title" (Main Title) and "subtitle" (Members).
-            3. **Subsequent Slides** must contain "title" and "points" (Bullet points, separated by \\n).
-            4. Do NOT use Markdown formatting (no ```json). Just raw JSON.
-            5. Minimum 7 slides.
-
-            【Example Format】:
-            [
-                {{"title": "{course_name} Final Project: [Topic]", "subtitle": "Members: {members}\\nDate: {current_date}"}},
-                {{"title": "Project Goals", "points": "1. Goal A\\n2. Goal B"}},
-                {{"title": "Task Allocation", "points": "• Alice: Frontend\\n• Bob: Backend"}}
-            ]
-            """
+        instructions = f"""
+Please generate a "Google Slides Outline" for this project.
+
+【STRICT FORMAT REQUIREMENTS】:
+1. Output a valid JSON Array.
+2. **First Slide (Cover)** must contain "title" (Main Title) and "subtitle" (Members).
+3. **Subsequent Slides** must contain "title" and "points" (Bullet points, separated by \\n).
+4. Do NOT use Markdown formatting (no ```json). Just raw JSON.
+5. Minimum 7 slides.
+
+【Example Format】:
+[
+    {{"title": "{course_name} Final Project: [Topic]", "subtitle": "Members: {members}\\nDate: {current_date}"}},
+    {{"title": "Project Goals", "points": "1. Goal A\\n2. Goal B"}},
+    {{"title": "Task Allocation", "points": "• Alice: Frontend\\n• Bob: Backend"}}
+]
+"""
     else:
-        # (Docs Prompt - Unchanged)
-        prompt = f"""
-        You are a professional Project Manager.
-        [Course]: {course_name}
-        [Members]: {members}
-        [Assignment]: {assignment_text}
-        [Date]: Today is {current_date}, Due is {due_date}.
-
-        Please generate a comprehensive project proposal.
-
-        【STRICT FORMAT - NO MARKDOWN TABLES】:
-        1. **Plain Text Only**.
-        2. **Do NOT use '|' characters**. Do NOT use Markdown tables.
-        3. Use [Brackets] for headers.
-        4. Task Allocation Format: "- [Task Name]: [Owner] (Deliverable: [Item])"
-
-        【Example Output】:
-        [1. Project Goal]
-        The goal is to develop...
-
-        [2. Tasks]
-        - Crawler Dev: Alice (Deliverable: Python script)
-        - Backend: Bob (Deliverable: API Docs)
-
-        [3. Schedule]
-        - 12/20: Arch Review
-        """
+        instructions = """
+Please generate a comprehensive project proposal.
+
+【STRICT FORMAT - NO MARKDOWN TABLES】:
+1. **Plain Text Only**.
+2. **Do NOT use '|' characters**. Do NOT use Markdown tables.
+3. Use [Brackets] for headers.
+4. Task Allocation Format: "- [Task Name]: [Owner] (Deliverable: [Item])"
+
+【Example Output】:
+[1. Project Goal]
+The goal is to develop...
+
+[2. Tasks]
+- Crawler Dev: Alice (Deliverable: Python script)
+- Backend: Bob (Deliverable: API Docs)
+
+[3. Schedule]
+- 12/20: Arch Review
+"""
+
+    return context + instructions
+
+def warm_up_local_model(timeout=120):
+    """
+    Loads the Ollama model into memory ahead of the first real request and pins it
+    there for OLLAMA_KEEP_ALIVE. No-op for hosted providers.
+    Returns: True if the model was warmed up.
+    """
+    provider, model_name, api_url, headers = get_llm_config()
+    if provider != "ollama":
+        return False
+
+    # An empty prompt to /api/generate just loads the model
+    generate_url = re.sub(r"/api/chat/?$", "/api/generate", api_url)
+    try:
+        response = requests.post(
+            generate_url,
+            headers=headers,
+            json={"model": model_name, "keep_alive": os.getenv("OLLAMA_KEEP_ALIVE", "30m")},
+            timeout=(5, timeout)
+        )
+        print(f"🔥 Warm-up {model_name}: HTTP {response.status_code}")
+        return response.status_code == 200
+    except requests.exceptions.RequestException as e:
+        print(f"⚠️ Warm-up failed: {e}")
+        return False
+
+def generate_project_plan(course_name, members, assignment_text, current_date, due_date, output_format="Docs", retries=3):
+    """
+    Calls LLM API to generate project plan with automatic retries.
+    Raises: LLMGenerationError on failure after all retries.
+    """
+    
+    # --- Configuration ---
+    provider, model_name, api_url, headers = get_llm_config()
+
+    # --- Prompt Construction ---
+    prompt = build_prompt(course_name, members, assignment_text, current_date, due_date, output_format)
 
     # --- Payload Construction ---
     payload = {}
@@ -120,6 +159,9 @@ def generate_project_plan(course_name, members, assignment_text, current_date, d
             "stream": False,
             "options": {"temperature": 0.7}
         }
+        if provider == "ollama":
+            # Keep the model (and its prompt cache) loaded between the Docs and Slides calls
+            payload["keep_alive"] = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
 
     # 🟢 RETRY LOOP LOGIC (Fixes Issue #11)
     print(f"🚀 Sending request to {provider.upper()} (Max Retries: {retries})...")
@@ -130,7 +172,9 @@ def generate_project_plan(course_name, members, assignment_text, current_date, d
             if attempt > 0:
                 print(f"🔄 Retry Attempt {attempt + 1}/{retries}...")
 
-            response = requests.post(api_url, headers=headers, json=payload, timeout=(10, 300))
+            # 🟢 Shared token bucket + concurrency cap for the LLM gateway
+            with get_limiter("llm").throttle():
+                response = requests.post(api_url, headers=headers, json=payload, timeout=(10, 300))
             
             if response.status_code != 200:
                 raise LLMGenerationError(f"API Error ({response.status_code}): {response.text}")
@@ -187,3 +231,15 @@ def extract_text_from_pdf(pdf_file):
         return text
     except Exception as e:
         return f"Error reading PDF: {e}"
+
+def normalize_text(text):
+    """Collapses the whitespace noise PDF extraction leaves behind (runs of spaces, blank lines)."""
+    text = re.sub(r"[ \t\u3000]+", " ", text)
+    text = re.sub(r" *\n *", "\n", text)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+def estimate_tokens(text):
+    """Rough token count: ~1 token per CJK character, ~4 characters per token otherwise."""
+    cjk = len(re.findall(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]", text))
+    return cjk + (len(text) - cjk + 3) // 4
@@ -3,9 +3,16 @@ import time
 import datetime
 import re
 import os
-from custom_exceptions import LLMGenerationError  # Import Exception
+import threading
+import uuid
+from custom_exceptions import LLMGenerationError, StageError, SlidesBatchError  # Import Exception
 from google_utils import get_google_service, create_doc_with_content, create_slides_presentation, share_file_permissions, send_gmail
-from llm_helper import extract_text_from_pdf, generate_project_plan
+from llm_helper import generate_project_plan, warm_up_local_model
+from speculation import speculate_upload, take_preprocessed, preprocess_documents
+from document_extractors import supported_types
+from rate_limiter import get_stats, rate_limit_user
+from checkpoint import RunCheckpoint, list_runs, DONE
+from profiling import RunProfiler, profile_stage, profiling_enabled
 
 # --- Page Setup ---
 st.set_page_config(page_title="Course Agent", page_icon="🤖", layout="wide")
@@ -26,8 +33,304 @@ def draw_dag():
     }
     """
 
+@st.cache_resource
+def start_model_warm_up():
+    """Warms the local (Ollama) model once per server process, in the background."""
+    thread = threading.Thread(target=warm_up_local_model, name="llm-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+def login_configured():
+    """True if Streamlit's OIDC login (st.login) is set up in .streamlit/secrets.toml [auth]."""
+    try:
+        return "auth" in st.secrets
+    except Exception:
+        return False
+
+def current_user_id():
+    """
+    Verified identity keying stored credentials and runs: the Streamlit login, else the
+    Google account this session authorized (set on login). None until one of them exists.
+    """
+    try:
+        email = st.user.get("email")
+    except Exception:
+        email = None
+    return email or st.session_state.get("google_user")
+
+def run_owner_id():
+    """
+    Key for this session's checkpoints: the verified identity, else an ID private to this
+    browser session (e.g. the shared st.secrets account), so no one sees another's runs.
+    """
+    user_id = current_user_id()
+    if user_id:
+        return user_id
+    if "anonymous_owner" not in st.session_state:
+        st.session_state.anonymous_owner = f"session-{uuid.uuid4().hex}"
+    return st.session_state.anonymous_owner
+
+# --- Pipeline Stages (checkpointed, see checkpoint.py) ---
+def selected_stages(inputs):
+    stages = ["extract"]
+    if inputs["use_docs"]: stages += ["generate-docs", "create-doc", "share-doc"]
+    if inputs["use_slides"]: stages += ["generate-slides", "create-slides", "share-slides"]
+    return stages + ["email"]
+
+def incomplete_runs(user_id, limit=20):
+    """Run IDs of this user's most recent runs that still have failed or missing stages."""
+    if not user_id:
+        return []
+    run_ids = []
+    for run in list_runs(user_id):
+        if any(run["stages"].get(stage) != DONE for stage in selected_stages(run["inputs"])):
+            run_ids.append(run["run_id"])
+            if len(run_ids) == limit:
+                break
+    return run_ids
+
+def run_stage(ckpt, stage, fn):
+    """
+    Runs one stage, or returns its checkpointed output if it already succeeded.
+    Failures are recorded on the checkpoint and re-raised.
+    """
+    if ckpt.is_done(stage):
+        st.caption(f"⏭️ {stage}：沿用先前結果")
+        return ckpt.output(stage)
+    try:
+        with profile_stage(stage):
+            output = fn()
+    except Exception as e:
+        partial = e.output if isinstance(e, StageError) else None
+        ckpt.mark_failed(stage, getattr(e, "message", e), output=partial or ckpt.output(stage))
+        raise
+    ckpt.mark_done(stage, output)
+    return output
+
+def extract_stage(files, use_speculation=True):
+    if not files:
+        raise StageError("找不到作業說明檔，請重新上傳後再繼續")
+    preprocessed = take_preprocessed(st.session_state, files) if use_speculation else preprocess_documents(files)
+    for source in preprocessed["sources"]:
+        if source["error"]:
+            st.warning(f"⚠️ 無法讀取 {source['name']}: {source['error']}")
+    if not preprocessed["text"]:
+        raise StageError("無法讀取作業說明內容")
+    return preprocessed
+
+def generate_stage(inputs, pdf_text, output_format):
+    return generate_project_plan(inputs["course_name"], inputs["raw_ids"], pdf_text, inputs["today"], inputs["deadline"], output_format)
+
+def share_stage(ckpt, stage, drive_svc, file_id, emails):
+    """Shares with everyone not already shared with in a previous attempt."""
+    already = ckpt.output(stage) or []
+    pending = [email for email in emails if email not in already]
+    failed = share_file_permissions(drive_svc, file_id, pending)
+    failed_emails = [email for email, _ in failed]
+    shared = already + [email for email in pending if email not in failed_emails]
+    if failed:
+        raise StageError(f"共用權限設定失敗 ({len(failed)} 人)：" + ", ".join(failed_emails), output=shared)
+    return shared
+
+def email_stage(ckpt, gmail_svc, emails, subject, body):
+    """Emails everyone not already notified in a previous attempt."""
+    already = ckpt.output("email") or []
+    pending = [email for email in emails if email not in already]
+    success_emails, failed_emails = send_gmail(gmail_svc, pending, subject, body)
+    if success_emails:
+        st.success(f"✅ Email 發送成功 ({len(success_emails)} 人)：\n" + ", ".join(success_emails))
+    if failed_emails:
+        st.error(f"⚠️ 發送失敗 ({len(failed_emails)} 人)：")
+        for email, error_msg in failed_emails:
+            st.write(f"❌ **{email}** → {error_msg}")
+        raise StageError(f"{len(failed_emails)} 封 Email 發送失敗", output=already + success_emails)
+    return already + success_emails
+
+def run_pipeline(ckpt, services, log_container, files=None, profile=None):
+    """
+    Executes every selected stage of `ckpt`, skipping stages that already succeeded
+    (so "resume" only re-runs failed or missing ones).
+    profile: wrap the run in cProfile + tracemalloc (None: follow GPA_PROFILE).
+    Returns: True if the run is complete.
+    """
+    if profile is None:
+        profile = profiling_enabled()
+    with rate_limit_user(ckpt.inputs.get("user_id")):
+        if not profile:
+            return execute_stages(ckpt, services, log_container, files)
+
+        # The speculative extraction is skipped so it actually runs inside the profiled stage
+        with RunProfiler(ckpt.run_id) as profiler:
+            is_complete = execute_stages(ckpt, services, log_container, files, use_speculation=False)
+    show_profile(profiler, log_container)
+    return is_complete
+
+def show_profile(profiler, log_container):
+    summary = profiler.summary()
+    with log_container:
+        with st.expander(f"🔬 效能剖析 (總計 {summary['total_s']} 秒)"):
+            st.table([{k: v for k, v in stage.items() if k != "top_functions"} for stage in summary["stages"]])
+            if summary["cprofile"]:
+                st.markdown("**Top functions (cumulative time)**")
+                st.dataframe(summary["top_functions"])
+            else:
+                st.caption("ℹ️ 另一個執行正在使用 cProfile，本次只有計時、記憶體與堆疊取樣 (.collapsed)")
+            st.caption("Artifacts: " + ", ".join(f"`{path}`" for path in profiler.artifacts.values()))
+
+def execute_stages(ckpt, services, log_container, files=None, use_speculation=True):
+    """Body of run_pipeline (see there)."""
+    gmail_svc, drive_svc, docs_svc, slides_svc = services
+    inputs = ckpt.inputs
+    course_name = inputs["course_name"]
+    emails = inputs["emails"]
+    is_success = True
+
+    # --- 1. Read Documents ---
+    with log_container:
+        st.caption(f"🆔 Run ID: `{ckpt.run_id}`")
+        st.write("📂 讀取作業說明中...")
+        try:
+            preprocessed = run_stage(ckpt, "extract", lambda: extract_stage(files, use_speculation))
+        except StageError as e:
+            st.error(f"❌ {e.message}")
+            return False
+        pdf_text = preprocessed["text"]
+        loaded = [f"{s['name']} ({s['tokens']} tokens)" for s in preprocessed.get("sources", []) if not s["error"]]
+        st.success(f"✅ 讀取完成：{', '.join(loaded)}，合併後約 {preprocessed['tokens']} tokens")
+
+    doc_url = None
+    slide_url = None
+
+    # --- 2. Google Docs ---
+    if inputs["use_docs"]:
+        with log_container:
+            st.info("📝 正在處理 Google Docs 任務...")
+            with st.spinner("🤖 AI 正在撰寫企劃書..."):
+                try:
+                    # 🟢 Try Block for Error Handling
+                    plan_docs = run_stage(ckpt, "generate-docs", lambda: generate_stage(inputs, pdf_text, "Docs"))
+
+                    def create_doc():
+                        doc_title = f"[{course_name}] 期末報告企劃書"
+                        doc_id, url = create_doc_with_content(docs_svc, drive_svc, doc_title, plan_docs)
+                        if not url:
+                            raise StageError("企劃書建立失敗 (API 回傳空值)")
+                        return {"id": doc_id, "url": url}
+
+                    doc = run_stage(ckpt, "create-doc", create_doc)
+                    doc_url = doc["url"]
+                    st.success(f"✅ 企劃書建立成功: [點擊開啟]({doc_url})")
+                    try:
+                        run_stage(ckpt, "share-doc", lambda: share_stage(ckpt, "share-doc", drive_svc, doc["id"], emails))
+                    except StageError as e:
+                        # Sharing problems don't block the email (as before), but stay resumable
+                        st.warning(f"⚠️ {e.message}")
+
+                except LLMGenerationError as e:
+                    # 🟢 Catch Custom Exception
+                    st.error(f"❌ Docs 生成失敗: {e.message}")
+                    is_success = False
+                except StageError as e:
+                    st.error(f"❌ {e.message}")
+                    is_success = False
+                except Exception as e:
+                    st.error(f"❌ 企劃書建立過程發生錯誤: {e}")
+                    is_success = False
+
+    # --- 3. Google Slides ---
+    if inputs["use_slides"]:
+        with log_container:
+            st.info("📊 正在處理 Google Slides 任務...")
+            with st.spinner("🤖 AI 正在規劃簡報架構..."):
+                try:
+                    # 🟢 Try Block for Error Handling
+                    plan_slides = run_stage(ckpt, "generate-slides", lambda: generate_stage(inputs, pdf_text, "Slides"))
+
+                    def create_slides():
+                        slide_title = f"[{course_name}] 期末報告簡報"
+                        progress_bar = st.progress(0.0, text="📤 上傳簡報內容...")
+                        def on_progress(done, total, label):
+                            progress_bar.progress(done / total, text=f"📤 {label} ({done}/{total} 批)")
+                        # A failed earlier attempt leaves its deck + unsent batches; finish that deck instead of making a new one
+                        partial = ckpt.output("create-slides")
+                        try:
+                            slide_id, result = create_slides_presentation(
+                                slides_svc, drive_svc, slide_title, plan_slides,
+                                progress=on_progress, resume=partial if partial and "pending_batches" in partial else None
+                            )
+                        except SlidesBatchError as e:
+                            raise StageError(
+                                f"簡報內容寫入未完成 ({e.message})，續跑時只會重送失敗的批次",
+                                output={"presentation_id": e.presentation_id, "pending_batches": e.pending_batches}
+                            )
+                        if not slide_id:
+                            # create_slides_presentation returns (None, error message) on failure
+                            raise StageError(f"簡報建立失敗 (JSON 解析錯誤或 API 權限問題): {result}")
+                        return {"id": slide_id, "url": result}
+
+                    slides = run_stage(ckpt, "create-slides", create_slides)
+                    slide_url = slides["url"]
+                    st.success(f"✅ 簡報建立成功: [點擊開啟]({slide_url})")
+                    try:
+                        run_stage(ckpt, "share-slides", lambda: share_stage(ckpt, "share-slides", drive_svc, slides["id"], emails))
+                    except StageError as e:
+                        st.warning(f"⚠️ {e.message}")
+
+                except LLMGenerationError as e:
+                    # 🟢 Catch Custom Exception
+                    st.error(f"❌ Slides 生成失敗: {e.message}")
+                    is_success = False
+                except StageError as e:
+                    st.error(f"❌ {e.message}")
+                    is_success = False
+                except Exception as e:
+                    st.error(f"❌ 簡報建立過程發生錯誤: {e}")
+                    is_success = False
+
+    # --- 4. Send Email ---
+    with log_container:
+        if not is_success:
+            st.error("⛔️ 由於部分檔案生成失敗，系統已終止，不會發送 Email 以免誤導組員。")
+            st.info(f"♻️ 可在左側欄「續跑未完成的執行」選擇 `{ckpt.run_id}`，只重跑失敗的步驟。")
+            return False
+
+        st.write("📧 正在寄信通知組員...")
+        subject = f"[{course_name}] 期末報告分工通知 (AI Agent)"
+        
+        links_text = ""
+        if doc_url: links_text += f"📄 企劃書連結：{doc_url}\n"
+        if slide_url: links_text += f"📊 簡報連結：{slide_url}\n"
+
+        email_body = f"""
+        各位同學好：
+        
+        這是一封由 AI Agent 自動發送的通知。
+        針對 {course_name} 的期末報告，我已經根據作業說明產生了初步架構。
+        
+        請大家到以下連結開始協作：
+        {links_text}
+        
+        祝 報告順利！
+        """
+        
+        try:
+            run_stage(ckpt, "email", lambda: email_stage(ckpt, gmail_svc, emails, subject, email_body))
+        except StageError:
+            pass  # failures already listed by email_stage
+        except Exception as e:
+             st.error(f"⚠️ 寄信功能發生系統錯誤: {e}")
+
+        if ckpt.pending_stages(selected_stages(inputs)):
+            st.info(f"♻️ 部分步驟未完成，可在左側欄「續跑未完成的執行」選擇 `{ckpt.run_id}` 重試。")
+            return False
+
+        st.balloons()
+        st.success("🏆 所有流程執行完畢！")
+        return True
+
 # --- Main Program ---
 def main():
+    start_model_warm_up()
     st.title("🎓 GPA (Group Project Agent)")
     st.markdown("### Intelligent Agent for Group Projects")
     
@@ -38,18 +341,51 @@ def main():
         if 'services' not in st.session_state:
             st.session_state.services = None
 
+        # 🟢 With a Streamlit login, stored Google tokens are reused by every session of the same user
+        if login_configured():
+            if st.user.get("email"):
+                st.caption(f"👤 {st.user.get('email')}")
+                st.button("登出", on_click=st.logout)
+            else:
+                st.button("👤 使用者登入", on_click=st.login)
+                st.caption("登入後，已授權的 Google 服務下次開啟時可直接沿用")
+
         if st.button("🔑 登入 Google"):
             try:
-                gmail, drive, docs, slides = get_google_service()
-                if gmail:
-                    st.session_state.services = (gmail, drive, docs, slides)
-                    st.success("登入成功！")
+                services, user_id = get_google_service(current_user_id())
+                if services:
+                    st.session_state.services = services
+                    st.session_state.google_user = user_id
+                    st.success(f"登入成功！({user_id or '共用帳號'})")
             except Exception as e:
                 st.error(f"登入失敗: {e}")
         
         if st.session_state.services:
             st.success("✅ Google 服務已連線")
         
+        resume_clicked = False
+        resume_run_id = None
+        with st.expander("♻️ 續跑未完成的執行"):
+            runs = incomplete_runs(run_owner_id())
+            if runs:
+                resume_run_id = st.selectbox("Run ID", runs)
+                resume_clicked = st.button("🔁 繼續執行 (只重跑失敗/未完成的步驟)")
+            else:
+                st.caption("沒有未完成的執行")
+
+        profile_run = st.toggle(
+            "🔬 效能剖析 (cProfile + tracemalloc)",
+            value=profiling_enabled(),
+            help="剖析下一次執行，結果存於 PROFILE_DIR (預設 .profiles/)"
+        )
+
+        with st.expander("📈 API 流量狀態"):
+            limiter_stats = get_stats(current_user_id())
+            if limiter_stats:
+                st.table(limiter_stats)
+            else:
+                st.caption("尚未送出任何 API 請求")
+
         st.divider()
         st.markdown("**System Logic (DAG)**")
         st.graphviz_chart(draw_dag())
@@ -58,10 +394,25 @@ def main():
 
     with col1:
         st.subheader("1️⃣ 輸入專案資訊")
+        # 🟢 Uploader lives outside the form so an upload triggers a rerun and
+        # extraction starts in the background while the form is being filled in
+        uploaded_files = st.file_uploader(
+            "上傳作業說明 (PDF / DOCX / PPTX / TXT / HTML，可多檔)",
+            type=supported_types(),
+            accept_multiple_files=True
+        )
+        files = [(f.name, f.getvalue()) for f in uploaded_files or []]
+        if files:
+            speculation = speculate_upload(st.session_state, files)
+            preprocessed = speculation.preprocess_status()
+            if preprocessed:
+                st.caption(f"⚡ 已預先讀取 {len(files)} 個檔案 ({len(preprocessed['text'])} 字，約 {preprocessed['tokens']} tokens)")
+            else:
+                st.caption(f"⏳ 正在背景預先讀取 {len(files)} 個檔案...")
+
         with st.form("project_input"):
             course_name = st.text_input("課程名稱", "計算理論")
             raw_ids = st.text_area("組員學號或 Email (用逗號分隔)", "f74122030, joshuatseng0233@gmail.com")
-            uploaded_file = st.file_uploader("上傳作業說明 (PDF)", type="pdf")
             default_deadline = datetime.date.today() + datetime.timedelta(days=14)
             deadline = st.date_input("📅 報告截止日期", default_deadline)
             
@@ -71,6 +422,7 @@ def main():
             
             submitted = st.form_submit_button("🚀 啟動 Agent")
 
+
     with col2:
         st.subheader("2️⃣ Agent 執行日誌")
         log_container = st.container(height=400)
@@ -79,129 +431,35 @@ def main():
         if not st.session_state.services:
             st.error("請先在左側欄登入 Google！")
             st.stop()
-        if not uploaded_file:
-            st.error("請上傳 PDF 作業說明檔！")
+        if not files:
+            st.error("請上傳作業說明檔！")
             st.stop()
         if not use_docs and not use_slides:
             st.error("⚠️ 請至少選擇一種產出格式 (Docs 或 Slides)！")
             st.stop()
 
-        gmail_svc, drive_svc, docs_svc, slides_svc = st.session_state.services
-        
         student_ids_list = [s.strip() for s in raw_ids.split(',') if s.strip()]
         default_domain = os.getenv("DEFAULT_EMAIL_DOMAIN", "gs.ncku.edu.tw")
         emails = [f"{sid}@{default_domain}" if "@" not in sid else sid for sid in student_ids_list]
-        
-        today_str = str(datetime.date.today())
-        deadline_str = str(deadline)
-        is_success = True
 
-        with log_container:
-            st.write("📂 讀取 PDF 中...")
-            pdf_text = extract_text_from_pdf(uploaded_file)
-            if not pdf_text:
-                st.error("❌ 無法讀取 PDF 內容")
-                st.stop()
-            st.success(f"✅ PDF 讀取完成 ({len(pdf_text)} 字)")
-
-        doc_url = None
-        slide_url = None
-
-        # --- 2. Google Docs ---
-        if use_docs:
-            with log_container:
-                st.info("📝 正在處理 Google Docs 任務...")
-                with st.spinner("🤖 AI 正在撰寫企劃書..."):
-                    try:
-                        # 🟢 Try Block for Error Handling
-                        plan_docs = generate_project_plan(course_name, raw_ids, pdf_text, today_str, deadline_str, "Docs")
-                        
-                        doc_title = f"[{course_name}] 期末報告企劃書"
-                        doc_id, doc_url = create_doc_with_content(docs_svc, drive_svc, doc_title, plan_docs)
-                        
-                        if doc_url:
-                            st.success(f"✅ 企劃書建立成功: [點擊開啟]({doc_url})")
-                            share_file_permissions(drive_svc, doc_id, emails)
-                        else:
-                            st.error("❌ 企劃書建立失敗 (API 回傳空值)")
-                            is_success = False
-
-                    except LLMGenerationError as e:
-                        # 🟢 Catch Custom Exception
-                        st.error(f"❌ Docs 生成失敗: {e.message}")
-                        is_success = False
-                    except Exception as e:
-                        st.error(f"❌ 企劃書建立過程發生錯誤: {e}")
-                        is_success = False
-
-        # --- 3. Google Slides ---
-        if use_slides:
-            with log_container:
-                st.info("📊 正在處理 Google Slides 任務...")
-                with st.spinner("🤖 AI 正在規劃簡報架構..."):
-                    try:
-                        # 🟢 Try Block for Error Handling
-                        plan_slides = generate_project_plan(course_name, raw_ids, pdf_text, today_str, deadline_str, "Slides")
-                        
-                        slide_title = f"[{course_name}] 期末報告簡報"
-                        slide_id, slide_url = create_slides_presentation(slides_svc, drive_svc, slide_title, plan_slides)
-                        
-                        if slide_url:
-                            st.success(f"✅ 簡報建立成功: [點擊開啟]({slide_url})")
-                            share_file_permissions(drive_svc, slide_id, emails)
-                        else:
-                            # Note: create_slides_presentation still returns None on error
-                            # Ideally, we should refactor that too, but keeping it simple for now.
-                            st.error("❌ 簡報建立失敗 (JSON 解析錯誤或 API 權限問題)")
-                            is_success = False
-                            
-                    except LLMGenerationError as e:
-                        # 🟢 Catch Custom Exception
-                        st.error(f"❌ Slides 生成失敗: {e.message}")
-                        is_success = False
-                    except Exception as e:
-                        st.error(f"❌ 簡報建立過程發生錯誤: {e}")
-                        is_success = False
-
-        # --- 4. Send Email ---
-        with log_container:
-            if not is_success:
-                st.error("⛔️ 由於部分檔案生成失敗，系統已終止，不會發送 Email 以免誤導組員。")
-                st.stop()
-
-            st.write("📧 正在寄信通知組員...")
-            subject = f"[{course_name}] 期末報告分工通知 (AI Agent)"
-            
-            links_text = ""
-            if doc_url: links_text += f"📄 企劃書連結：{doc_url}\n"
-            if slide_url: links_text += f"📊 簡報連結：{slide_url}\n"
-
-            email_body = f"""
-            各位同學好：
-            
-            這是一封由 AI Agent 自動發送的通知。
-            針對 {course_name} 的期末報告，我已經根據作業 PDF 產生了初步架構。
-            
-            請大家到以下連結開始協作：
-            {links_text}
-            
-            祝 報告順利！
-            """
-            
-            try:
-                success_emails, failed_emails = send_gmail(gmail_svc, emails, subject, email_body)
-                if success_emails:
-                    st.success(f"✅ Email 發送成功 ({len(success_emails)} 人)：\n" + ", ".join(success_emails))
-                if failed_emails:
-                    st.error(f"⚠️ 發送失敗 ({len(failed_emails)} 人)：")
-                    for email, error_msg in failed_emails:
-                        st.write(f"❌ **{email}** → {error_msg}")
-                if success_emails:
-                    st.balloons()
-                    st.success("🏆 所有流程執行完畢！")
+        ckpt = RunCheckpoint.create({
+            "user_id": run_owner_id(),
+            "course_name": course_name,
+            "raw_ids": raw_ids,
+            "emails": emails,
+            "today": str(datetime.date.today()),
+            "deadline": str(deadline),
+            "use_docs": use_docs,
+            "use_slides": use_slides,
+        })
+        run_pipeline(ckpt, st.session_state.services, log_container, files, profile=profile_run)
 
-            except Exception as e:
-                 st.error(f"⚠️ 寄信功能發生系統錯誤: {e}")
+    elif resume_clicked:
+        if not st.session_state.services:
+            st.error("請先在左側欄登入 Google！")
+            st.stop()
+        ckpt = RunCheckpoint.load(resume_run_id, run_owner_id())
+        run_pipeline(ckpt, st.session_state.services, log_container, files, profile=profile_run)
 
 if __name__ == "__main__":
     main()
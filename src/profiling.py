@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+# On-demand profiling of one pipeline run.
+# - cProfile per stage (pipeline thread) -> top functions by cumulative time, merged into <run_id>.pstats
+# - tracemalloc                          -> peak memory per stage
+# - stack sampler (pipeline thread + pool workers while they run this run's tasks, see
+#   profile_worker) -> <run_id>.collapsed, flamegraph-ready
+#   (flamegraph.pl / speedscope / inferno: one "frame;frame;frame count" line per stack)
+#
+# cProfile and tracemalloc are process-wide, and several sessions may profile at once:
+# - only one run uses cProfile at a time (Python 3.12+ refuses a second active profiler);
+#   the others fall back to timing + sampling, flagged by "cprofile": false in the summary
+# - tracemalloc is reference-counted across runs, and a stage only resets the global peak
+#   while its run is the only one tracing; otherwise its peak is sampled (coarser, and
+#   includes the other runs' allocations)
+#
+# Env:
+#   GPA_PROFILE        "1" to profile every run (headless path); the UI also has a sidebar toggle
+#   PROFILE_DIR        where artifacts are written (default: .profiles)
+#   PROFILE_SAMPLE_MS  sampling interval for the collapsed stacks (default: 5)
+
+_active = threading.local()
+
+_cprofile_lock = threading.Lock()
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_started = False  # True if we started it (so we also stop it)
+
+
+def profiling_enabled():
+    return os.getenv("GPA_PROFILE", "0") == "1"
+
+
+def _acquire_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracemalloc_started = True
+        _tracemalloc_users += 1
+
+
+def _release_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_started:
+            tracemalloc.stop()
+            _tracemalloc_started = False
+
+
+def _reset_peak_if_alone():
+    """Resets tracemalloc's global peak only if no other run is tracing. Returns whether it did."""
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 1:
+            tracemalloc.reset_peak()
+            return True
+        return False
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})".replace(";", ",")
+
+
+class RunProfiler:
+    """Context manager wrapping one pipeline run; use `stage(name)` around each stage."""
+
+    def __init__(self, run_id, out_dir=None, sample_interval=None, top_n=15):
+        self.run_id = run_id
+        self.out_dir = out_dir or os.getenv("PROFILE_DIR", ".profiles")
+        self.sample_interval = sample_interval or int(os.getenv("PROFILE_SAMPLE_MS", "5")) / 1000
+        self.top_n = top_n
+        self.stages = []
+        self.artifacts = {}
+        self._stats = None
+        self._samples = Counter()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name="profiler-sampler", daemon=True)
+        self._cprofile = False
+        self._stage_mem_peak = None  # sampled traced memory during the current stage
+        self._mem_lock = threading.Lock()
+        self._workers = set()  # idents of pool threads currently running a task for this run
+
+    # --- lifecycle ---
+    def __enter__(self):
+        self._thread_id = threading.get_ident()
+        self._cprofile = _cprofile_lock.acquire(blocking=False)
+        _acquire_tracemalloc()
+        self._start = time.perf_counter()
+        self._sampler.start()
+        _active.profiler = self
+        return self
+
+    def __exit__(self, *exc):
+        _active.profiler = None
+        self._stop.set()
+        self._sampler.join()
+        self.total_s = time.perf_counter() - self._start
+        _release_tracemalloc()
+        if self._cprofile:
+            _cprofile_lock.release()
+        self._write_artifacts()
+        return False
+
+    @contextmanager
+    def stage(self, name):
+        profile = cProfile.Profile() if self._cprofile else None
+        exact_peak = _reset_peak_if_alone()
+        mem_before = tracemalloc.get_traced_memory()[0]
+        with self._mem_lock:
+            self._stage_mem_peak = mem_before
+        start = time.perf_counter()
+        if profile:
+            try:
+                profile.enable()
+            except ValueError:
+                profile = None  # another profiling tool is active (e.g. a debugger); sample only
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+            elapsed = time.perf_counter() - start
+            current, peak = tracemalloc.get_traced_memory()
+            with self._mem_lock:
+                if not exact_peak:
+                    peak = max(self._stage_mem_peak, current)
+                self._stage_mem_peak = None
+            stats = pstats.Stats(profile) if profile else None
+            if stats:
+                self._stats = stats if self._stats is None else self._stats.add(stats)
+            self.stages.append({
+                "stage": name,
+                "seconds": round(elapsed, 3),
+                "peak_mem_mb": round(max(0, peak - mem_before) / (1024 * 1024), 2),
+                "top_functions": self._top_functions(stats) if stats else [],
+            })
+
+    # --- collection ---
+    def _sample(self):
+        while not self._stop.wait(self.sample_interval):
+            with self._mem_lock:
+                if self._stage_mem_peak is not None:
+                    self._stage_mem_peak = max(self._stage_mem_peak, tracemalloc.get_traced_memory()[0])
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                name = names.get(thread_id, "")
+                if thread_id != self._thread_id and thread_id not in self._workers:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                root = "pipeline" if thread_id == self._thread_id else name.rstrip("_0123456789")
+                self._samples[";".join([root] + stack[::-1])] += 1
+
+    def _top_functions(self, stats):
+        rows = []
+        for (filename, lineno, func), (cc, nc, tt, ct, callers) in stats.stats.items():
+            rows.append({
+                "function": f"{func} ({os.path.basename(filename)}:{lineno})",
+                "calls": nc,
+                "cumulative_s": round(ct, 4),
+                "own_s": round(tt, 4),
+            })
+        rows.sort(key=lambda r: r["cumulative_s"], reverse=True)
+        return rows[:self.top_n]
+
+    # --- output ---
+    def _write_artifacts(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        base = os.path.join(self.out_dir, self.run_id)
+
+        if self._stats is not None:
+            self._stats.dump_stats(base + ".pstats")
+            self.artifacts["pstats"] = base + ".pstats"
+
+        with open(base + ".collapsed", "w", encoding="utf-8") as f:
+            for stack, count in self._samples.most_common():
+                f.write(f"{stack} {count}\n")
+        self.artifacts["collapsed"] = base + ".collapsed"
+
+        with open(base + ".summary.json", "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+        self.artifacts["summary"] = base + ".summary.json"
+
+    def summary(self):
+        return {
+            "run_id": self.run_id,
+            "total_s": round(getattr(self, "total_s", 0.0), 3),
+            "cprofile": self._stats is not None,
+            "samples": sum(self._samples.values()),
+            "stages": self.stages,
+            "top_functions": self._top_functions(self._stats) if self._stats else [],
+        }
+
+
+def profile_worker(fn):
+    """
+    Wraps a task before it is submitted to a worker pool: while it runs, its worker thread is
+    sampled by the run profiled in the submitting thread. Pools are shared by sessions, so
+    workers busy with another session's tasks stay out of this run's stacks.
+    """
+    profiler = getattr(_active, "profiler", None)
+    if profiler is None:
+        return fn
+
+    def run(*args, **kwargs):
+        ident = threading.get_ident()
+        profiler._workers.add(ident)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler._workers.discard(ident)
+    return run
+
+
+@contextmanager
+def profile_stage(name):
+    """Profiles `name` if a RunProfiler is active in this thread; otherwise a no-op."""
+    profiler = getattr(_active, "profiler", None)
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
@@ -0,0 +1,192 @@
+import os
+import threading
+import time
+import contextlib
+import contextvars
+from contextlib import contextmanager
+
+# Process-wide request throttling for Google APIs and the LLM gateway.
+# Each API gets one token bucket shared by every Streamlit session in this process (the
+# per-project quota), plus one bucket per user for APIs with a per-user quota, so a whole
+# class using the app at once stays under both instead of bouncing off 429s.
+# The user is taken from `rate_limit_user(user_id)` around the caller's work.
+#
+# Env overrides (per API, e.g. DRIVE / DOCS / SLIDES / GMAIL / LLM):
+#   RATE_LIMIT_<API>_QPS         sustained requests per second, per project (0 = unlimited)
+#   RATE_LIMIT_<API>_BURST       bucket size (max requests sent back-to-back)
+#   RATE_LIMIT_<API>_USER_QPS    same, per user (0 = no per-user bucket)
+#   RATE_LIMIT_<API>_USER_BURST
+#   LLM_MAX_CONCURRENCY          max in-flight LLM requests (0 = unlimited)
+
+# (qps, burst) per project — derived from the default quotas:
+#   Docs / Slides 600 write requests/min, Drive 12,000 queries/min,
+#   Gmail 1,200,000 units/min (send = 100 units)
+DEFAULT_LIMITS = {
+    "drive": (10.0, 20),
+    "docs": (10.0, 10),
+    "slides": (10.0, 10),
+    "gmail": (20.0, 20),
+    "llm": (2.0, 4),
+}
+# (qps, burst) per user:
+#   Docs / Slides 60 write requests/min (0.9/s + burst 5 stays under 60 in any minute),
+#   Gmail 250 units/s (= 2.5 sends/s)
+DEFAULT_USER_LIMITS = {
+    "docs": (0.9, 5),
+    "slides": (0.9, 5),
+    "gmail": (2.0, 5),
+}
+DEFAULT_LLM_CONCURRENCY = 4
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket with an optional concurrency cap.
+    Use `with bucket.throttle():` around a single request.
+    """
+    def __init__(self, name, rate, burst, max_concurrency=0):
+        self.name = name
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.max_concurrency = int(max_concurrency)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_concurrency) if self.max_concurrency > 0 else None
+
+        # Stats
+        self.waiting = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _take_token(self):
+        """Returns 0 if a token was taken, otherwise the seconds to wait for the next one."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """Blocks until a token (and a concurrency slot, if capped) is available. Returns seconds waited."""
+        start = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        try:
+            if self.rate > 0:
+                delay = self._take_token()
+                while delay:
+                    time.sleep(delay)
+                    delay = self._take_token()
+            if self._slots:
+                self._slots.acquire()
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+        waited = time.monotonic() - start
+        with self._lock:
+            self.in_flight += 1
+            self.calls += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        if self._slots:
+            self._slots.release()
+
+    @contextmanager
+    def throttle(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self.waiting,
+                "in_flight": self.in_flight,
+                "calls": self.calls,
+                "avg_wait_s": round(self.total_wait / self.calls, 3) if self.calls else 0.0,
+                "max_wait_s": round(self.max_wait, 3),
+            }
+
+
+_limiters = {}
+_registry_lock = threading.Lock()
+_current_user = contextvars.ContextVar("rate_limit_user", default=None)
+
+
+def get_limiter(api, user=None):
+    """
+    Returns the process-wide limiter for `api`, or `user`'s own limiter for it
+    (created from env on first use). None if `api` has no per-user limit.
+    """
+    api = api.lower()
+    with _registry_lock:
+        key = (api, user)
+        if key not in _limiters:
+            if user is None:
+                rate, burst = DEFAULT_LIMITS.get(api, (0, 1))
+                prefix = f"RATE_LIMIT_{api.upper()}"
+            else:
+                rate, burst = DEFAULT_USER_LIMITS.get(api, (0, 1))
+                prefix = f"RATE_LIMIT_{api.upper()}_USER"
+            rate = float(os.getenv(f"{prefix}_QPS", rate))
+            burst = float(os.getenv(f"{prefix}_BURST", burst))
+            if user is not None and rate <= 0:
+                _limiters[key] = None
+            else:
+                concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", DEFAULT_LLM_CONCURRENCY)) if api == "llm" and user is None else 0
+                name = api if user is None else f"{api}:{user}"
+                _limiters[key] = TokenBucket(name, rate, burst, concurrency)
+        return _limiters[key]
+
+
+@contextmanager
+def rate_limit_user(user_id):
+    """Charges requests made inside this block (this thread/context) to `user_id`'s quota too."""
+    token = _current_user.set(user_id)
+    try:
+        yield
+    finally:
+        _current_user.reset(token)
+
+
+@contextmanager
+def throttle(api):
+    """Waits for the current user's bucket (if any), then the project bucket for `api`."""
+    user = _current_user.get()
+    user_limiter = get_limiter(api, user) if user else None
+    with user_limiter.throttle() if user_limiter else contextlib.nullcontext():
+        with get_limiter(api).throttle():
+            yield
+
+
+def execute(request, api, **kwargs):
+    """Runs a googleapiclient request (`.execute(**kwargs)`) under the limiters for `api`."""
+    with throttle(api):
+        return request.execute(**kwargs)
+
+
+def get_stats(user=None):
+    """Snapshot of queue depth / wait time for every project-wide limiter (and `user`'s own)."""
+    with _registry_lock:
+        limiters = {key: limiter for key, limiter in _limiters.items() if limiter and key[1] in (None, user)}
+    return {limiter.name: limiter.stats() for limiter in limiters.values()}
+
+
+def reset_limiters():
+    """Drops all limiters so the next call re-reads the env (used by tests)."""
+    with _registry_lock:
+        _limiters.clear()
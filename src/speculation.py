@@ -0,0 +1,84 @@
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from document_extractors import extract_documents, merge_documents
+
+# Speculative pre-processing: starts document extraction as soon as files are uploaded,
+# while the user is still filling in the form. On submit the result is reused only if the
+# files are unchanged; otherwise it is discarded.
+# (No draft plans: form values only reach the server on submit, so a draft would be
+# generated from stale inputs and waste a rate-limited LLM call.)
+#
+# Env:
+#   SPECULATION_WORKERS  background threads shared by all sessions (default: 4)
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SPECULATION_WORKERS", "4")),
+    thread_name_prefix="speculate"
+)
+
+
+def fingerprint(files):
+    """Identity of an upload set: [(name, bytes), ...]."""
+    digest = hashlib.sha256()
+    for name, data in files:
+        digest.update(name.encode() + b"\0" + hashlib.sha256(data).digest())
+    return digest.hexdigest()
+
+
+def preprocess_documents(files):
+    """
+    Parallel extract + normalize + merge under the token budget.
+    Same function on the speculative and the submit path.
+    """
+    documents = extract_documents(files)
+    text, tokens = merge_documents(documents)
+    sources = [{"name": d["name"], "tokens": d["tokens"], "error": d["error"]} for d in documents]
+    return {"text": text, "tokens": tokens, "sources": sources}
+
+
+class Speculation:
+    """Background work for one set of uploaded files (kept in st.session_state)."""
+
+    def __init__(self, files):
+        self.fingerprint = fingerprint(files)
+        self.preprocessed = _executor.submit(preprocess_documents, files)
+
+    def preprocess_status(self):
+        """Returns the preprocess result if finished successfully, else None (never blocks)."""
+        if self.preprocessed.done() and not self.preprocessed.cancelled() and not self.preprocessed.exception():
+            return self.preprocessed.result()
+        return None
+
+    def discard(self):
+        """Cancels the extraction if it hasn't started yet; running work finishes and is dropped."""
+        self.preprocessed.cancel()
+
+
+def speculate_upload(state, files, key="speculation"):
+    """
+    Returns the Speculation for `files` ([(name, bytes), ...]), starting one if the upload set is new.
+    A previous speculation for different files is discarded.
+    """
+    current = state.get(key)
+    if current is not None and current.fingerprint == fingerprint(files):
+        return current
+    if current is not None:
+        current.discard()
+    state[key] = Speculation(files)
+    return state[key]
+
+
+def take_preprocessed(state, files, key="speculation"):
+    """
+    Preprocessed corpus for the submitted files: speculative result if it matches, else computed now.
+    If the speculative job is still queued behind other sessions' work, it is cancelled and
+    the files are extracted inline instead of waiting for a free worker.
+    """
+    current = state.get(key)
+    if current is not None and current.fingerprint == fingerprint(files) and not current.preprocessed.cancel():
+        try:
+            return current.preprocessed.result()
+        except Exception:
+            pass
+    return preprocess_documents(files)
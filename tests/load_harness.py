@@ -0,0 +1,347 @@
+"""
+Concurrent-user load test for the app (offline, headless).
+
+Runs N simulated sessions at once in ONE process — like one Streamlit server — against a
+local mock LLM server and fake Google services. Each session is a thread doing what the
+UI does: upload (starts speculative extraction), think time, then submit (run_pipeline),
+with `st` stubbed out. Everything the app shares per process is exercised: the rate
+limiters, the extraction / speculation / Slides pools, the credential and model caches,
+and the GIL. For each load level it reports end-to-end latency percentiles (successful
+sessions only) and the process's peak thread count and RSS growth divided by N.
+
+Usage:
+    python tests/load_harness.py --levels 1,2,4,8 --llm-latency 0.5 --google-latency 0.05
+    python tests/load_harness.py --levels 1,5,10,20 --slides --json load_report.json
+
+Not collected by pytest (file name doesn't start with test_).
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import logging
+import resource
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import llm_helper  # imported before apply_mock_env(), so its load_dotenv() can't override the mock settings
+# The app module; importing it outside `streamlit run` only warns about the missing runtime
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+import main as app
+from checkpoint import RunCheckpoint
+from speculation import speculate_upload
+
+MOCK_DOCS_PLAN = """[1. Project Goal]
+Build a small demo for the load test.
+
+[2. Tasks]
+- Backend: Alice (Deliverable: API Docs)
+- Frontend: Bob (Deliverable: UI)
+"""
+
+MOCK_SLIDES_PLAN = json.dumps([
+    {"title": "Load Test Project", "subtitle": "Members: Alice, Bob"},
+    {"title": "Goals", "points": "1. Goal A\n2. Goal B"},
+    {"title": "Tasks", "points": "• Alice: Backend\n• Bob: Frontend"},
+])
+
+
+# --- Mock LLM endpoint (Ollama /api/chat format) ---
+class MockLLMHandler(BaseHTTPRequestHandler):
+    latency = 0.5
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        prompt = body.get("messages", [{}])[-1].get("content", "")
+        time.sleep(self.latency)
+        content = MOCK_SLIDES_PLAN if "Google Slides Outline" in prompt else MOCK_DOCS_PLAN
+        data = json.dumps({"message": {"role": "assistant", "content": content}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_mock_llm(latency):
+    handler = type("Handler", (MockLLMHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# --- Fake Google services ---
+class FakeRequest:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def execute(self, **kwargs):
+        time.sleep(self.latency)
+        file_id = uuid.uuid4().hex[:12]
+        return {
+            "documentId": file_id,
+            "presentationId": file_id,
+            "slides": [{"objectId": "default_slide"}],
+            "webViewLink": f"https://example.invalid/{file_id}",
+            "id": file_id,
+        }
+
+
+class FakeService:
+    """Accepts any googleapiclient-style chain, e.g. service.documents().create(body=...).execute()."""
+    def __init__(self, latency):
+        self.latency = latency
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: FakeChain(self.latency)
+
+
+class FakeChain(FakeService):
+    def __getattr__(self, name):
+        if name == "execute":
+            return FakeRequest(self.latency).execute
+        return super().__getattr__(name)
+
+
+def make_pdf(text):
+    """Builds a minimal one-page PDF whose text pypdf can extract."""
+    stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{i} 0 obj\n".encode() + obj + b"\nendobj\n"
+    xref_pos = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        pdf += f"{offset:010d} 00000 n \n".encode()
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_pos}\n%%EOF\n".encode()
+    return pdf
+
+
+# --- Metrics ---
+def current_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Fallback (macOS reports bytes, Linux KB): peak rather than current RSS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class ResourceMonitor:
+    """Samples the process's thread count and RSS in the background while a load level runs."""
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_threads = 0
+        self.peak_rss = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            self.peak_rss = max(self.peak_rss, current_rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+# --- Headless Streamlit ---
+class NullElement:
+    """Stands in for any Streamlit call or element: callable, context manager, attribute chain."""
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def __getattr__(self, name):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class HeadlessStreamlit(NullElement):
+    """`st` for sessions running as threads: per-thread session_state, errors recorded per thread."""
+    def __init__(self):
+        self._local = threading.local()
+
+    def _session(self):
+        if not hasattr(self._local, "state"):
+            self._local.state, self._local.errors = {}, []
+        return self._local
+
+    @property
+    def session_state(self):
+        return self._session().state
+
+    @property
+    def errors(self):
+        return self._session().errors
+
+    def error(self, message, *args, **kwargs):
+        self.errors.append(str(message))
+        return self
+
+
+def apply_mock_env(mock_env):
+    """
+    Points the app at the mock endpoints. Must run after llm_helper is imported: its
+    load_dotenv(override=True) would otherwise replace these with a developer's .env.
+    Refuses to continue if the LLM endpoint still isn't the mock (no real traffic or API key).
+    """
+    os.environ.update(mock_env)
+    api_url = llm_helper.get_llm_config()[2]
+    if api_url != mock_env["API_URL"]:
+        raise RuntimeError(f"LLM endpoint is {api_url}, not the mock; refusing to send load")
+
+
+# --- One simulated user ---
+def run_session(args, session_no, pdf_bytes, barrier):
+    """Uploads, fills the form (think time), waits for the others, submits. Returns (latency_s, ok, error)."""
+    st = app.st
+    try:
+        files = [("assignment.pdf", pdf_bytes)]
+        speculate_upload(st.session_state, files)  # what the upload rerun does
+        time.sleep(args.think_time)
+
+        user_id = f"load-user-{session_no}@example.com"
+        ckpt = RunCheckpoint.create({
+            "user_id": user_id,
+            "course_name": "Load Test Course",
+            "raw_ids": "alice@example.com, bob@example.com",
+            "emails": ["alice@example.com", "bob@example.com"],
+            "today": str(datetime.date.today()),
+            "deadline": str(datetime.date.today() + datetime.timedelta(days=14)),
+            "use_docs": True,
+            "use_slides": args.slides,
+        })
+        services = tuple(FakeService(args.google_latency) for _ in range(4))
+        barrier.wait(args.timeout)
+    except Exception as e:
+        barrier.abort()  # don't leave the other sessions waiting
+        return None, False, f"{type(e).__name__}: {e}"
+
+    start = time.perf_counter()
+    try:
+        ok = app.run_pipeline(ckpt, services, NullElement(), files)
+    except Exception as e:
+        return None, False, f"{type(e).__name__}: {e}"
+    latency = time.perf_counter() - start
+    error = st.errors[0] if st.errors else (None if ok else "Run did not complete")
+    return latency, ok, error
+
+
+def run_level(args, users, pdf_bytes):
+    barrier = threading.Barrier(users)
+    rss_before = current_rss_mb()
+    with ResourceMonitor() as monitor, ThreadPoolExecutor(max_workers=users, thread_name_prefix="session") as pool:
+        results = list(pool.map(lambda n: run_session(args, n, pdf_bytes, barrier), range(users)))
+
+    # Failed sessions have no (or a partial) latency, so they stay out of the percentiles
+    latencies = [r[0] for r in results if r[1]]
+    failures = [r[2] for r in results if not r[1]]
+    return {
+        "users": users,
+        "ok": users - len(failures),
+        "failed": len(failures),
+        "p50_s": round(percentile(latencies, 50), 3),
+        "p95_s": round(percentile(latencies, 95), 3),
+        "p99_s": round(percentile(latencies, 99), 3),
+        "max_s": round(max(latencies, default=0.0), 3),
+        "peak_threads": monitor.peak_threads,
+        "rss_per_session_mb": round(max(0.0, monitor.peak_rss - rss_before) / users, 2),
+        "peak_rss_mb": round(monitor.peak_rss, 1),
+        "first_error": failures[0] if failures else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-user load test for the GPA Streamlit app.")
+    parser.add_argument("--levels", default="1,2,4,8", help="Comma-separated concurrent user counts to ramp through")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Mock LLM response time (s)")
+    parser.add_argument("--google-latency", type=float, default=0.05, help="Fake Google API call time (s)")
+    parser.add_argument("--slides", action="store_true", help="Also generate Slides (two LLM calls per run)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Seconds between upload and submit (form filling)")
+    parser.add_argument("--timeout", type=float, default=120, help="Max seconds a session waits for the others to be ready")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="Keep the configured rate limits instead of disabling them")
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's own console output")
+    args = parser.parse_args()
+
+    server = start_mock_llm(args.llm_latency)
+    mock_env = {
+        "LLM_PROVIDER": "ollama",
+        "MODEL_NAME": "mock",
+        "API_URL": f"http://127.0.0.1:{server.server_port}/api/chat",
+        "API_KEY": "",
+        "CHECKPOINT_DIR": tempfile.mkdtemp(prefix="gpa-load-runs-"),
+    }
+    if not args.keep_rate_limits:
+        for api in ("DRIVE", "DOCS", "SLIDES", "GMAIL", "LLM"):
+            mock_env[f"RATE_LIMIT_{api}_QPS"] = "0"
+            mock_env[f"RATE_LIMIT_{api}_USER_QPS"] = "0"
+        mock_env["LLM_MAX_CONCURRENCY"] = "0"
+    apply_mock_env(mock_env)
+    app.st = HeadlessStreamlit()
+
+    pdf_bytes = make_pdf("Build a Hello World app as a team and present it in class.")
+    report = []
+    print(f"🚦 Ramping load: {args.levels} concurrent users (LLM {args.llm_latency}s, Google {args.google_latency}s)")
+    print(f"{'users':>6} {'ok':>4} {'fail':>5} {'p50':>7} {'p95':>7} {'p99':>7} {'threads':>8} {'RSS/sess':>9}")
+    for users in [int(n) for n in args.levels.split(",") if n.strip()]:
+        app_output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with app_output:
+            row = run_level(args, users, pdf_bytes)
+        report.append(row)
+        print(f"{row['users']:>6} {row['ok']:>4} {row['failed']:>5} {row['p50_s']:>7} {row['p95_s']:>7} "
+              f"{row['p99_s']:>7} {row['peak_threads']:>8} {row['rss_per_session_mb']:>8}M")
+        if row["first_error"]:
+            print(f"   ⚠️ First error: {row['first_error'][:200]}")
+
+    server.shutdown()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"📝 Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,11 +9,12 @@ st.title("🔐 Auth Logic Test")
 st.info("Attempting to retrieve credentials...")
 
 # Call the function in isolation
-creds = get_google_creds()
+creds, user_id = get_google_creds()
 
 if creds and creds.valid:
     st.success("✅ **Success!** Valid credentials retrieved.")
     st.json({
+        "Account": user_id,
         "Scopes": creds.scopes,
         "Token Valid": creds.valid,
         "Expired": creds.expired
@@ -0,0 +1,130 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import tempfile
+from unittest.mock import patch, MagicMock
+from checkpoint import RunCheckpoint, list_runs
+import main
+
+INPUTS = {
+    "user_id": "default",
+    "course_name": "計算理論",
+    "raw_ids": "alice@example.com",
+    "emails": ["alice@example.com"],
+    "today": "2025-01-01",
+    "deadline": "2025-01-15",
+    "use_docs": True,
+    "use_slides": True,
+}
+
+def test_checkpoint_persists():
+    print("🧪 Testing Checkpoint Persistence...")
+    with tempfile.TemporaryDirectory() as tmp:
+        ckpt = RunCheckpoint.create(INPUTS, base_dir=tmp)
+        ckpt.mark_done("extract", {"text": "Assignment", "tokens": 3})
+        ckpt.mark_failed("create-slides", "quota exceeded")
+
+        reloaded = RunCheckpoint.load(ckpt.run_id, "default", base_dir=tmp)
+        assert RunCheckpoint.load(ckpt.run_id, "mallory", base_dir=tmp) is None
+        runs = list_runs("default", base_dir=tmp)
+        assert [run["run_id"] for run in runs] == [ckpt.run_id]
+        assert runs[0]["stages"] == {"extract": "done", "create-slides": "failed"}  # statuses only, no outputs
+        assert reloaded.output("extract")["text"] == "Assignment"
+        assert reloaded.pending_stages(["extract", "create-slides", "email"]) == ["create-slides", "email"]
+        print("✅ SUCCESS: Stage outputs survive a reload.")
+
+def test_resume_only_reruns_failed_stages():
+    print("🧪 Testing Resume After Slides Failure...")
+    with tempfile.TemporaryDirectory() as tmp, \
+         patch.object(main, "take_preprocessed", return_value={"text": "Assignment", "tokens": 3, "sources": []}), \
+         patch.object(main, "generate_project_plan", return_value="PLAN") as mock_llm, \
+         patch.object(main, "create_doc_with_content", return_value=("doc1", "https://docs/doc1")) as mock_doc, \
+         patch.object(main, "create_slides_presentation", return_value=(None, "quota exceeded")) as mock_slides, \
+         patch.object(main, "share_file_permissions", return_value=[]) as mock_share, \
+         patch.object(main, "send_gmail", return_value=(["alice@example.com"], [])) as mock_gmail:
+        services = (MagicMock(), MagicMock(), MagicMock(), MagicMock())
+        ckpt = RunCheckpoint.create(INPUTS, base_dir=tmp)
+
+        assert main.run_pipeline(ckpt, services, MagicMock(), [("spec.pdf", b"pdf")]) is False
+        assert mock_gmail.call_count == 0  # no email after a failed stage
+
+        mock_slides.return_value = ("slides1", "https://slides/slides1")
+        resumed = RunCheckpoint.load(ckpt.run_id, "default", base_dir=tmp)
+        assert main.run_pipeline(resumed, services, MagicMock()) is True
+
+        print(f"📊 LLM calls: {mock_llm.call_count}, Docs created: {mock_doc.call_count}, Shares: {mock_share.call_count}")
+        assert mock_llm.call_count == 2  # Docs + Slides, each generated once
+        assert mock_doc.call_count == 1
+        assert mock_share.call_count == 2  # doc once, slides once
+        assert mock_gmail.call_count == 1
+        print("✅ SUCCESS: Resume skipped every finished stage.")
+
+def test_resume_finishes_partial_slides_deck():
+    print("🧪 Testing Resume of a Partially Written Slides Deck...")
+    pending = [[{"insertText": {"objectId": "gen_body_3", "text": "• Point"}}]]
+    with tempfile.TemporaryDirectory() as tmp, \
+         patch.object(main, "take_preprocessed", return_value={"text": "Assignment", "tokens": 3, "sources": []}), \
+         patch.object(main, "generate_project_plan", return_value="PLAN"), \
+         patch.object(main, "create_slides_presentation", side_effect=[
+             main.SlidesBatchError("1/4 text batches failed", "pres1", pending),
+             ("pres1", "https://slides/pres1"),
+         ]) as mock_slides, \
+         patch.object(main, "share_file_permissions", return_value=[]), \
+         patch.object(main, "send_gmail", return_value=(["alice@example.com"], [])):
+        services = (MagicMock(), MagicMock(), MagicMock(), MagicMock())
+        ckpt = RunCheckpoint.create(dict(INPUTS, use_docs=False), base_dir=tmp)
+        assert main.run_pipeline(ckpt, services, MagicMock(), [("spec.pdf", b"pdf")]) is False
+        assert mock_slides.call_args.kwargs["resume"] is None
+
+        resumed = RunCheckpoint.load(ckpt.run_id, "default", base_dir=tmp)
+        assert main.run_pipeline(resumed, services, MagicMock()) is True
+        assert mock_slides.call_args.kwargs["resume"] == {"presentation_id": "pres1", "pending_batches": pending}
+        assert resumed.output("create-slides") == {"id": "pres1", "url": "https://slides/pres1"}
+    print("✅ SUCCESS: Resume completed the existing deck.")
+
+def test_resume_list_is_per_user():
+    print("🧪 Testing Resume List (per user, limit after filtering)...")
+    with tempfile.TemporaryDirectory() as tmp, patch.dict(os.environ, {"CHECKPOINT_DIR": tmp}):
+        failed = RunCheckpoint.create(dict(INPUTS, user_id="alice@example.com"))
+        failed.mark_failed("extract", "bad file")
+        finished = RunCheckpoint.create(dict(INPUTS, user_id="alice@example.com", use_docs=False, use_slides=False))
+        for stage in main.selected_stages(finished.inputs):
+            finished.mark_done(stage)
+        for i in range(25):  # the rest of the class runs afterwards
+            RunCheckpoint.create(dict(INPUTS, user_id=f"student{i}@example.com"))
+
+        print(f"📊 alice: {main.incomplete_runs('alice@example.com')}")
+        assert main.incomplete_runs("alice@example.com") == [failed.run_id]
+        assert len(main.incomplete_runs("student0@example.com")) == 1
+        assert main.incomplete_runs(None) == []
+    print("✅ SUCCESS: Other users' runs neither show up nor push this user's failed run out.")
+
+class SessionState(dict):
+    __getattr__ = dict.get
+    __setattr__ = dict.__setitem__
+
+def test_shared_account_runs_stay_per_session():
+    print("🧪 Testing Shared st.secrets Account (no login) -> Runs Private to Each Session...")
+    sessions = [SessionState(google_user=None), SessionState(google_user=None)]
+    owners = []
+    with tempfile.TemporaryDirectory() as tmp, patch.dict(os.environ, {"CHECKPOINT_DIR": tmp}), \
+         patch.object(main, "st") as mock_st:
+        mock_st.user.get.return_value = None
+        for state in sessions:
+            mock_st.session_state = state
+            owners.append(main.run_owner_id())
+            assert main.run_owner_id() == owners[-1]  # stable across reruns
+            RunCheckpoint.create(dict(INPUTS, user_id=owners[-1])).mark_failed("extract", "bad file")
+
+        print(f"📊 owners: {owners}")
+        assert owners[0] != owners[1] and "default" not in owners
+        runs = [main.incomplete_runs(owner) for owner in owners]
+        assert len(runs[0]) == len(runs[1]) == 1 and runs[0] != runs[1]
+    print("✅ SUCCESS: Sessions without a verified identity can't see each other's runs.")
+
+if __name__ == "__main__":
+    test_checkpoint_persists()
+    test_resume_only_reruns_failed_stages()
+    test_resume_finishes_partial_slides_deck()
+    test_resume_list_is_per_user()
+    test_shared_account_runs_stay_per_session()
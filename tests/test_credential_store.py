@@ -0,0 +1,183 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import datetime
+import json
+import tempfile
+import threading
+from unittest.mock import patch, MagicMock
+from google.oauth2.credentials import Credentials
+from streamlit.testing.v1 import AppTest
+import credential_store
+from credential_store import SQLiteCredentialStore, FileCredentialStore
+import google_utils
+
+def make_creds(token, expired):
+    offset = datetime.timedelta(hours=-1 if expired else 1)
+    return Credentials(
+        token=token,
+        refresh_token="refresh-token",
+        token_uri="https://oauth2.googleapis.com/token",
+        client_id="client-id",
+        client_secret="client-secret",
+        scopes=google_utils.SCOPES,
+        expiry=datetime.datetime.utcnow() + offset
+    )
+
+def test_sqlite_store_per_user():
+    print("🧪 Testing SQLite Credential Store (per-user isolation)...")
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SQLiteCredentialStore(os.path.join(tmp, "creds.db"))
+        store.save("alice@gmail.com", '{"token": "a"}')
+        store.save("bob@gmail.com", '{"token": "b"}')
+        store.save("alice@gmail.com", '{"token": "a2"}')
+
+        assert store.load("alice@gmail.com") == '{"token": "a2"}'
+        assert store.load("bob@gmail.com") == '{"token": "b"}'
+        assert store.load("carol@gmail.com") is None
+        print("✅ SUCCESS: Tokens stored and overwritten per user.")
+
+def test_concurrent_refresh_happens_once():
+    print("🧪 Testing Concurrent Refresh (8 sessions, 1 refresh)...")
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SQLiteCredentialStore(os.path.join(tmp, "creds.db"))
+        store.save("alice@gmail.com", make_creds("old", expired=True).to_json())
+        refresh_calls = []
+
+        def fake_refresh(self, request):
+            refresh_calls.append(1)
+            self.token = "new"
+            self.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+
+        results = []
+        def session():
+            stale = make_creds("old", expired=True)
+            results.append(google_utils._refresh_creds("alice@gmail.com", stale, store).token)
+
+        with patch.object(Credentials, "refresh", fake_refresh):
+            threads = [threading.Thread(target=session) for _ in range(8)]
+            for t in threads: t.start()
+            for t in threads: t.join()
+
+        print(f"📊 Refresh calls: {len(refresh_calls)}, tokens: {set(results)}")
+        assert len(refresh_calls) == 1
+        assert set(results) == {"new"}
+        print("✅ SUCCESS: Later sessions reused the refreshed token from the store.")
+
+def test_refresh_lock_is_per_user():
+    print("🧪 Testing Refresh Lock (per user, across store instances)...")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "creds.db")
+        # Two instances stand in for two server processes (separate in-process locks)
+        first, second = SQLiteCredentialStore(db_path), SQLiteCredentialStore(db_path)
+
+        def try_lock(store, user_id):
+            acquired = threading.Event()
+            def hold():
+                with store.lock(user_id):
+                    acquired.set()
+            thread = threading.Thread(target=hold, daemon=True)
+            thread.start()
+            return acquired.wait(0.5), thread
+
+        with first.lock("alice@gmail.com"):
+            other_user, _ = try_lock(second, "bob@gmail.com")
+            same_user, waiting = try_lock(second, "alice@gmail.com")
+        waiting.join(2)
+
+        print(f"📊 bob acquired: {other_user}, alice acquired while held: {same_user}")
+        assert other_user and not same_user
+        assert not waiting.is_alive()
+    print("✅ SUCCESS: Only the same user's refresh waits.")
+
+def test_stored_tokens_need_verified_identity():
+    print("🧪 Testing Login Without Verified Identity (no lookup by typed email)...")
+    google_utils._creds_cache.clear()
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SQLiteCredentialStore(os.path.join(tmp, "creds.db"))
+        victim = make_creds("victim-token", expired=False)
+        store.save("alice@gmail.com", victim.to_json())
+
+        flow = MagicMock()
+        flow.run_local_server.return_value = make_creds("bob-token", expired=False)
+        with patch.object(google_utils.os.path, "exists", return_value=True), \
+             patch.object(google_utils.InstalledAppFlow, "from_client_secrets_file", return_value=flow), \
+             patch.object(google_utils, "get_account_email", return_value="bob@gmail.com"):
+            creds, user_id = google_utils.get_google_creds(None, store)
+
+        print(f"🔹 Logged in as {user_id}")
+        assert (creds.token, user_id) == ("bob-token", "bob@gmail.com")
+        assert flow.run_local_server.called  # OAuth ran; nothing was loaded by name
+        assert "bob-token" in store.load("bob@gmail.com")
+        assert "victim-token" in store.load("alice@gmail.com")
+
+        # A verified identity (e.g. Streamlit login) reuses its own stored token
+        creds, user_id = google_utils.get_google_creds("alice@gmail.com", store)
+        assert (creds.token, user_id) == ("victim-token", "alice@gmail.com")
+    google_utils._creds_cache.clear()
+    print("✅ SUCCESS: Tokens are only stored and loaded under the verified account.")
+
+def test_unverifiable_legacy_token_reruns_consent():
+    print("🧪 Testing Legacy token.json Without Identity Scopes...")
+    google_utils._creds_cache.clear()
+    with tempfile.TemporaryDirectory() as tmp:
+        store = FileCredentialStore(os.path.join(tmp, "token.json"))
+        store.save("default", make_creds("legacy-token", expired=False).to_json())
+
+        flow = MagicMock()
+        flow.run_local_server.return_value = make_creds("fresh-token", expired=False)
+        def account_email(creds):
+            if creds.token == "legacy-token":
+                raise PermissionError("403 insufficient scopes")
+            return "alice@gmail.com"
+
+        with patch.object(google_utils.os.path, "exists", return_value=True), \
+             patch.object(google_utils.InstalledAppFlow, "from_client_secrets_file", return_value=flow), \
+             patch.object(google_utils, "get_account_email", side_effect=account_email):
+            creds, user_id = google_utils.get_google_creds(None, store)
+
+        assert (creds.token, user_id) == ("fresh-token", "alice@gmail.com")
+        assert "fresh-token" in store.load("alice@gmail.com")  # token.json replaced
+    google_utils._creds_cache.clear()
+    print("✅ SUCCESS: Consent re-run instead of failing the login.")
+
+def test_shared_secrets_account_has_no_identity():
+    print("🧪 Testing st.secrets Account Without Login -> No Shared user_id...")
+    google_utils._creds_cache.clear()
+    info = json.loads(make_creds("shared-token", expired=False).to_json())
+    with patch.object(google_utils.st, "secrets", {"google_oauth": info}), \
+         patch.object(google_utils, "get_account_email") as account_email:
+        creds, user_id = google_utils.get_google_creds(None, MagicMock(single_user=False))
+
+    assert (creds.token, user_id) == ("shared-token", None)
+    assert not account_email.called and not google_utils._creds_cache
+    print("✅ SUCCESS: The shared account isn't used as a per-user key.")
+
+def test_logged_in_sessions_reuse_stored_token():
+    print("🧪 Testing Streamlit Login -> Stored Token Reused Across Sessions...")
+    main_script = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src/main.py'))
+    google_utils._creds_cache.clear()
+    with tempfile.TemporaryDirectory() as tmp, \
+         patch.object(credential_store, "_store", SQLiteCredentialStore(os.path.join(tmp, "creds.db"))), \
+         patch.object(google_utils, "build", MagicMock()), \
+         patch.object(google_utils.InstalledAppFlow, "from_client_secrets_file") as mock_flow:
+        credential_store._store.save("test@example.com", make_creds("stored-token", expired=False).to_json())
+        for session in range(2):
+            google_utils._creds_cache.clear()  # e.g. a restarted server
+            at = AppTest.from_file(main_script, default_timeout=30)
+            at.secrets["auth"] = {"client_id": "client-id"}  # AppTest signs in as test@example.com
+            at.run()
+            next(b for b in at.sidebar.button if b.label.startswith("🔑")).click().run()
+            assert at.session_state["services"] is not None
+        assert not mock_flow.called
+    google_utils._creds_cache.clear()
+    print("✅ SUCCESS: No consent flow for a signed-in user with a stored token.")
+
+if __name__ == "__main__":
+    test_sqlite_store_per_user()
+    test_concurrent_refresh_happens_once()
+    test_refresh_lock_is_per_user()
+    test_stored_tokens_need_verified_identity()
+    test_unverifiable_legacy_token_reruns_consent()
+    test_shared_secrets_account_has_no_identity()
+    test_logged_in_sessions_reuse_stored_token()
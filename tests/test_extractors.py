@@ -0,0 +1,97 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import io
+import zipfile
+from document_extractors import extract_document, extract_documents, merge_documents, supported_types
+
+W_NS = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+A_NS = 'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"'
+
+def make_zip(parts):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, xml in parts.items():
+            archive.writestr(name, xml)
+    return buffer.getvalue()
+
+def make_docx(paragraphs):
+    body = "".join(f"<w:p><w:r><w:t>{p}</w:t></w:r></w:p>" for p in paragraphs)
+    return make_zip({"word/document.xml": f"<w:document {W_NS}><w:body>{body}</w:body></w:document>"})
+
+def make_pptx(slides):
+    parts = {}
+    for i, text in enumerate(slides, start=1):
+        parts[f"ppt/slides/slide{i}.xml"] = f"<p:sld {A_NS} xmlns:p=\"p\"><a:p><a:r><a:t>{text}</a:t></a:r></a:p></p:sld>"
+    return make_zip(parts)
+
+def test_formats():
+    print("🧪 Testing Extractors (DOCX / PPTX / HTML / TXT)...")
+    print(f"🔹 Supported: {supported_types()}")
+    cases = [
+        ("template.docx", make_docx(["Section 1: Intro", "Section 2: Method"]), "Section 2: Method"),
+        ("lecture.pptx", make_pptx(["Kickoff", "Deliverables"] + ["x"] * 9), "[Slide 2]\nDeliverables"),
+        ("rubric.html", b"<html><style>p{}</style><body><h1>Rubric</h1><p>Demo 40%</p></body></html>", "Rubric\n\nDemo 40%"),
+        ("notes.txt", "期末報告 說明".encode("utf-8"), "期末報告 說明"),
+    ]
+    for name, data, expected in cases:
+        doc = extract_document(name, data)
+        print(f"  - {name}: {doc['tokens']} tokens, error={doc['error']}")
+        assert doc["error"] is None
+        assert expected in doc["text"]
+    assert "p{}" not in extract_document(*cases[2][:2])["text"]
+    print("✅ SUCCESS: All formats extracted.")
+
+def test_errors_are_reported_per_file():
+    print("🧪 Testing Per-File Errors...")
+    docs = extract_documents([("spec.txt", b"Spec"), ("data.xlsx", b"..."), ("broken.docx", b"not a zip")])
+    assert [d["name"] for d in docs] == ["spec.txt", "data.xlsx", "broken.docx"]
+    assert docs[0]["error"] is None
+    assert "Unsupported" in docs[1]["error"]
+    assert docs[2]["error"]
+    print("✅ SUCCESS: Bad files reported without failing the batch.")
+
+def test_merge_labels_dedup_and_budget():
+    print("🧪 Testing Merge (labels, dedup, token budget)...")
+    shared = "Deadline: 2025-01-15, late submissions are not accepted."
+    docs = [
+        {"name": "spec.pdf", "text": f"Build a compiler.\n\n{shared}", "tokens": 20, "error": None},
+        {"name": "rubric.docx", "text": f"{shared}\n\nCorrectness 50%", "tokens": 20, "error": None},
+    ]
+    merged, tokens = merge_documents(docs, token_budget=1000)
+    print(merged)
+    assert "=== [Source: spec.pdf] ===" in merged and "=== [Source: rubric.docx] ===" in merged
+    assert merged.count(shared) == 1
+    assert "Correctness 50%" in merged
+
+    # pypdf / DOCX text: one "\n" between lines, no blank-line paragraphs
+    pdf_lines = [
+        {"name": "spec.pdf", "text": f"Build a compiler.\n{shared}\nTeams of 3", "tokens": 20, "error": None},
+        {"name": "slides.pptx", "text": f"Week 1\n{shared.upper()}\nTeams of 3", "tokens": 20, "error": None},
+    ]
+    merged, tokens = merge_documents(pdf_lines, token_budget=1000)
+    assert merged.lower().count(shared.lower()) == 1
+    assert "Week 1" in merged and merged.count("Teams of 3") == 2  # short lines are never dropped
+
+    long_docs = [{"name": f"doc{i}.txt", "text": "word " * 4000, "tokens": 5000, "error": None} for i in range(2)]
+    long_docs[1]["text"] = "other " * 4000
+    merged, tokens = merge_documents(long_docs, token_budget=2000)
+    print(f"📊 Budgeted merge: {tokens} tokens")
+    assert tokens <= 2100
+    assert "doc0.txt" in merged and "doc1.txt" in merged
+
+    spec = " ".join(f"rule{i}" for i in range(400))  # ~500 tokens
+    mixed = [
+        {"name": "spec.pdf", "text": spec, "tokens": 500, "error": None},
+        {"name": "deck.pptx", "text": "slide " * 70000, "tokens": 100000, "error": None},
+    ]
+    merged, tokens = merge_documents(mixed, token_budget=2000)
+    print(f"📊 Small spec + large deck: {tokens} tokens")
+    assert spec in merged  # the small source survives whole
+    assert tokens <= 2100 and "…(truncated)" in merged
+    print("✅ SUCCESS: Sources labelled, duplicates dropped, budget respected.")
+
+if __name__ == "__main__":
+    test_formats()
+    test_errors_are_reported_per_file()
+    test_merge_labels_dedup_and_budget()
@@ -0,0 +1,49 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+from unittest.mock import patch, MagicMock
+from llm_helper import build_prompt, generate_project_plan, warm_up_local_model
+
+ASSIGNMENT = "Build a compiler for a toy language. " * 50
+
+def test_docs_and_slides_share_prefix():
+    print("🧪 Testing Shared Prompt Prefix (Docs vs Slides)...")
+    docs = build_prompt("計算理論", "Alice, Bob", ASSIGNMENT, "2025-01-01", "2025-01-15", "Docs")
+    slides = build_prompt("計算理論", "Alice, Bob", ASSIGNMENT, "2025-01-01", "2025-01-15", "Slides")
+
+    shared = os.path.commonprefix([docs, slides])
+    print(f"📊 Shared prefix: {len(shared)} / {len(docs)} chars")
+    assert ASSIGNMENT in shared
+    assert "Due is 2025-01-15." in shared
+    print("✅ SUCCESS: Assignment context is an identical prefix.")
+
+def test_ollama_keep_alive_and_warm_up():
+    print("🧪 Testing Ollama keep_alive & Warm-up...")
+    env = {"LLM_PROVIDER": "ollama", "API_URL": "http://localhost:11434/api/chat", "OLLAMA_KEEP_ALIVE": "1h"}
+    with patch.dict(os.environ, env), patch('requests.post') as mock_post:
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"message": {"content": "[1. Project Goal]"}}
+        mock_post.return_value = mock_response
+
+        generate_project_plan("Test", "User", "Content", "Date", "Date", "Docs")
+        assert mock_post.call_args.kwargs["json"]["keep_alive"] == "1h"
+
+        assert warm_up_local_model() is True
+        url = mock_post.call_args.args[0]
+        print(f"🔹 Warm-up URL: {url}")
+        assert url == "http://localhost:11434/api/generate"
+        assert mock_post.call_args.kwargs["json"]["keep_alive"] == "1h"
+    print("✅ SUCCESS: keep_alive sent and model warmed via /api/generate.")
+
+def test_warm_up_skipped_for_hosted_providers():
+    print("🧪 Testing Warm-up No-op (OpenAI)...")
+    with patch.dict(os.environ, {"LLM_PROVIDER": "openai"}), patch('requests.post') as mock_post:
+        assert warm_up_local_model() is False
+        assert mock_post.call_count == 0
+    print("✅ SUCCESS: No warm-up request for hosted providers.")
+
+if __name__ == "__main__":
+    test_docs_and_slides_share_prefix()
+    test_ollama_keep_alive_and_warm_up()
+    test_warm_up_skipped_for_hosted_providers()
@@ -0,0 +1,154 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import json
+import pstats
+import tempfile
+import threading
+import cProfile
+import tracemalloc
+from unittest.mock import patch, MagicMock
+from profiling import RunProfiler, profile_stage, profile_worker
+
+def busy_parse(n):
+    return sum(len(str(i)) for i in range(n))
+
+def allocate_blocks():
+    return [bytearray(1024) for _ in range(20000)]  # ~20 MB
+
+def test_profile_run_artifacts():
+    print("🧪 Testing Run Profiler (stages, memory, artifacts)...")
+    with tempfile.TemporaryDirectory() as tmp:
+        with RunProfiler("run-123", out_dir=tmp, sample_interval=0.001) as profiler:
+            with profile_stage("extract"):
+                busy_parse(300000)
+            with profile_stage("generate-docs"):
+                blocks = allocate_blocks()
+                worker = threading.Thread(target=profile_worker(busy_parse), args=(300000,), name="slides_0")
+                worker.start()
+                worker.join()
+                del blocks
+
+        summary = profiler.summary()
+        for stage in summary["stages"]:
+            print(f"  - {stage['stage']}: {stage['seconds']}s, peak {stage['peak_mem_mb']} MB")
+        assert [s["stage"] for s in summary["stages"]] == ["extract", "generate-docs"]
+        assert summary["stages"][1]["peak_mem_mb"] > 15
+        assert any("busy_parse" in f["function"] for f in summary["stages"][0]["top_functions"])
+
+        assert sorted(os.listdir(tmp)) == ["run-123.collapsed", "run-123.pstats", "run-123.summary.json"]
+        pstats.Stats(os.path.join(tmp, "run-123.pstats"))  # loadable by the stdlib / snakeviz
+        with open(os.path.join(tmp, "run-123.collapsed")) as f:
+            lines = f.read().splitlines()
+        print(f"📊 {len(lines)} distinct stacks sampled")
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+        assert any(line.startswith("pipeline;") for line in lines)
+        assert any(line.startswith("slides;") for line in lines)
+        with open(os.path.join(tmp, "run-123.summary.json")) as f:
+            assert json.load(f)["run_id"] == "run-123"
+    print("✅ SUCCESS: pstats, collapsed stacks and per-stage summary written.")
+
+def spin(stop):
+    while not stop.is_set():
+        busy_parse(1000)
+
+def test_other_sessions_workers_not_sampled():
+    print("🧪 Testing Sampler Scope (only this run's pool tasks)...")
+    stop = threading.Event()
+    foreign = threading.Thread(target=spin, args=(stop,), name="slides_9")  # another session's worker
+    foreign.start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            with RunProfiler("run-d", out_dir=tmp, sample_interval=0.001) as profiler:
+                with profile_stage("create-slides"):
+                    worker = threading.Thread(target=profile_worker(busy_parse), args=(300000,), name="slides_0")
+                    worker.start()
+                    worker.join()
+            with open(os.path.join(tmp, "run-d.collapsed")) as f:
+                stacks = f.read().splitlines()
+    finally:
+        stop.set()
+        foreign.join()
+    print(f"📊 {len(stacks)} distinct stacks sampled")
+    assert any(line.startswith("slides;") and "busy_parse" in line for line in stacks)
+    assert not any("spin (" in line for line in stacks)
+    print("✅ SUCCESS: Another session's slides worker stayed out of the flamegraph.")
+
+def test_concurrent_profiled_runs():
+    print("🧪 Testing Concurrent Profiled Runs (cProfile + tracemalloc shared)...")
+    summaries = {}
+    first_inside = threading.Event()
+    second_done = threading.Event()
+
+    def first_run(tmp):
+        with RunProfiler("run-a", out_dir=tmp, sample_interval=0.001) as profiler:
+            with profile_stage("extract"):
+                first_inside.set()
+                second_done.wait(10)
+                busy_parse(100000)
+            assert tracemalloc.is_tracing()  # the other run finishing must not stop it
+        summaries["a"] = profiler.summary()
+
+    def second_run(tmp):
+        first_inside.wait(10)
+        try:
+            with RunProfiler("run-b", out_dir=tmp, sample_interval=0.001) as profiler:
+                with profile_stage("extract"):
+                    blocks = allocate_blocks()
+                    del blocks
+            summaries["b"] = profiler.summary()
+        finally:
+            second_done.set()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        threads = [threading.Thread(target=first_run, args=(tmp,)), threading.Thread(target=second_run, args=(tmp,))]
+        for t in threads: t.start()
+        for t in threads: t.join()
+
+    print(f"📊 cProfile: a={summaries['a']['cprofile']}, b={summaries['b']['cprofile']}; "
+          f"b peak {summaries['b']['stages'][0]['peak_mem_mb']} MB")
+    assert summaries["a"]["cprofile"] and not summaries["b"]["cprofile"]
+    assert summaries["b"]["stages"][0]["peak_mem_mb"] > 15  # sampled peak
+    assert not tracemalloc.is_tracing()
+    print("✅ SUCCESS: Second run fell back to sampling; tracemalloc stopped only after both.")
+
+def test_cprofile_refused_falls_back():
+    print("🧪 Testing Fallback When Another Profiler Is Active...")
+    class RefusingProfile(cProfile.Profile):
+        def enable(self, *args, **kwargs):
+            raise ValueError("Another profiling tool is already active")
+
+    with tempfile.TemporaryDirectory() as tmp, patch("profiling.cProfile.Profile", RefusingProfile):
+        with RunProfiler("run-c", out_dir=tmp, sample_interval=0.001) as profiler:
+            with profile_stage("extract"):
+                busy_parse(1000)
+        summary = profiler.summary()
+    assert summary["stages"][0]["stage"] == "extract" and not summary["cprofile"]
+    print("✅ SUCCESS: Stage ran and was timed without cProfile.")
+
+def test_toggle_overrides_env_default():
+    print("🧪 Testing Sidebar Toggle vs GPA_PROFILE...")
+    import main
+    with patch.dict(os.environ, {"GPA_PROFILE": "1"}), \
+         patch.object(main, "execute_stages", return_value=True), \
+         patch.object(main, "show_profile"), \
+         patch.object(main, "RunProfiler") as mock_profiler:
+        main.run_pipeline(MagicMock(), None, MagicMock(), profile=False)
+        assert not mock_profiler.called  # toggle switched off
+        main.run_pipeline(MagicMock(), None, MagicMock())
+        assert mock_profiler.called  # headless: env default applies
+    print("✅ SUCCESS: GPA_PROFILE is only the default.")
+
+def test_profile_stage_is_noop_without_profiler():
+    print("🧪 Testing profile_stage outside a profiled run...")
+    with profile_stage("extract"):
+        busy_parse(1000)
+    print("✅ SUCCESS: No profiler, no overhead, no error.")
+
+if __name__ == "__main__":
+    test_profile_run_artifacts()
+    test_other_sessions_workers_not_sampled()
+    test_concurrent_profiled_runs()
+    test_cprofile_refused_falls_back()
+    test_toggle_overrides_env_default()
+    test_profile_stage_is_noop_without_profiler()
@@ -0,0 +1,95 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import time
+import threading
+from unittest.mock import MagicMock
+import rate_limiter
+from rate_limiter import TokenBucket, get_limiter, execute, get_stats, rate_limit_user
+
+def test_token_bucket_rate():
+    print("🧪 Testing Token Bucket Rate (20 QPS, burst 5)...")
+    bucket = TokenBucket("test", rate=20, burst=5)
+
+    start = time.monotonic()
+    for _ in range(15):
+        with bucket.throttle():
+            pass
+    elapsed = time.monotonic() - start
+
+    # 5 burst tokens are free, the other 10 need ~0.5s at 20 QPS
+    print(f"📊 15 calls took {elapsed:.2f}s, stats: {bucket.stats()}")
+    assert 0.4 <= elapsed < 1.5
+    assert bucket.stats()["calls"] == 15
+    print("✅ SUCCESS: Throughput capped at the configured rate.")
+
+def test_concurrency_cap():
+    print("🧪 Testing Concurrency Semaphore (max 2 in flight)...")
+    bucket = TokenBucket("llm-test", rate=0, burst=1, max_concurrency=2)
+    peak = []
+
+    def worker():
+        with bucket.throttle():
+            peak.append(bucket.stats()["in_flight"])
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=worker) for _ in range(6)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    print(f"📊 Peak in-flight: {max(peak)}")
+    assert max(peak) <= 2
+    print("✅ SUCCESS: Never more than 2 requests in flight.")
+
+def test_env_config_and_execute():
+    print("🧪 Testing Env Configuration & execute() wrapper...")
+    os.environ["RATE_LIMIT_DRIVE_QPS"] = "0"
+    rate_limiter.reset_limiters()
+    try:
+        assert get_limiter("drive").rate == 0
+
+        request = MagicMock()
+        request.execute.return_value = {"id": "abc"}
+        assert execute(request, "drive") == {"id": "abc"}
+        assert get_stats()["drive"]["calls"] == 1
+        print("✅ SUCCESS: Env override applied and request executed through limiter.")
+    finally:
+        del os.environ["RATE_LIMIT_DRIVE_QPS"]
+        rate_limiter.reset_limiters()
+
+def test_per_user_buckets():
+    print("🧪 Testing Per-User Buckets (Slides: 5 QPS per user, burst 2)...")
+    env = {"RATE_LIMIT_SLIDES_QPS": "0", "RATE_LIMIT_SLIDES_USER_QPS": "5", "RATE_LIMIT_SLIDES_USER_BURST": "2"}
+    os.environ.update(env)
+    rate_limiter.reset_limiters()
+    try:
+        request = MagicMock()
+        elapsed = {}
+
+        def session(user):
+            start = time.monotonic()
+            with rate_limit_user(user):
+                for _ in range(6):
+                    execute(request, "slides")
+            elapsed[user] = time.monotonic() - start
+
+        threads = [threading.Thread(target=session, args=(user,)) for user in ("alice", "bob")]
+        for t in threads: t.start()
+        for t in threads: t.join()
+
+        # 2 burst tokens, then 4 more at 5 QPS (~0.8s) — for each user independently
+        print(f"📊 Elapsed per user: {elapsed}, stats: {get_stats('alice')}")
+        assert all(0.6 <= e < 1.5 for e in elapsed.values())
+        assert get_stats("alice")["slides:alice"]["calls"] == 6
+        assert "slides:bob" not in get_stats("alice")
+        assert get_limiter("drive", "alice") is None  # no per-user quota configured
+        print("✅ SUCCESS: Each user throttled to their own quota in parallel.")
+    finally:
+        for key in env: del os.environ[key]
+        rate_limiter.reset_limiters()
+
+if __name__ == "__main__":
+    test_token_bucket_rate()
+    test_concurrency_cap()
+    test_env_config_and_execute()
+    test_per_user_buckets()
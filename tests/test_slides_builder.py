@@ -0,0 +1,217 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import json
+import threading
+import time
+from unittest.mock import MagicMock, patch
+import httplib2
+from googleapiclient.errors import HttpError
+from custom_exceptions import SlidesBatchError
+import google_utils
+from google_utils import compile_slide_requests, chunk_requests, create_slides_presentation
+
+def make_outline(n):
+    slides = [{"title": "Cover", "subtitle": "Members: Alice, Bob"}]
+    slides += [{"title": f"Slide {i}", "points": [f"Point {i}.1", f"Point {i}.2"]} for i in range(1, n)]
+    return slides
+
+def http_error(status):
+    return HttpError(httplib2.Response({"status": status}), b"{}")
+
+def make_fake_slides_service(fail_first_batch_with=None):
+    """Records every batchUpdate; optionally fails the first text batch once."""
+    service = MagicMock()
+    service._http = None  # no credentials -> sequential text batches
+    service.presentations().create().execute.return_value = {
+        "presentationId": "pres1", "slides": [{"objectId": "default_slide"}]
+    }
+    sent = []
+    lock = threading.Lock()
+
+    def batch_update(presentationId, body):
+        request = MagicMock()
+        def execute(**kwargs):
+            with lock:
+                if fail_first_batch_with and "insertText" in body["requests"][0] and not any(b.get("failed") for b in sent):
+                    sent.append({"failed": True})
+                    raise fail_first_batch_with
+                sent.append(body)
+            return {}
+        request.execute.side_effect = execute
+        return request
+
+    service.presentations().batchUpdate.side_effect = batch_update
+    return service, sent
+
+def test_compile_single_pass():
+    print("🧪 Testing Slide Request Compiler...")
+    creation, text_groups = compile_slide_requests(make_outline(8), "Deck")
+    assert len(creation) == 8 and all("createSlide" in r for r in creation)
+    assert len(text_groups) == 8
+    assert text_groups[0][1]["updateTextStyle"]["objectId"] == "gen_title_0"
+    assert text_groups[3][1]["insertText"]["text"] == "• Point 3.1\n• Point 3.2"
+    print("✅ SUCCESS: Creation and text requests split per slide.")
+
+def test_chunk_bounds():
+    print("🧪 Testing Batch Chunking (count & bytes)...")
+    _, text_groups = compile_slide_requests(make_outline(200), "Deck")
+    batches = chunk_requests(text_groups, max_requests=50, max_bytes=4000)
+    print(f"📊 {sum(len(g) for g in text_groups)} requests -> {len(batches)} batches")
+    assert all(len(b) <= 50 for b in batches)
+    assert all(len(json.dumps(b, ensure_ascii=False).encode()) <= 4000 + 200 for b in batches)
+    assert sum(len(b) for b in batches) == sum(len(g) for g in text_groups)
+    print("✅ SUCCESS: Batches respect both limits without losing requests.")
+
+def test_large_deck_with_retry_and_progress():
+    print("🧪 Testing Large Deck (batched, retried, progress)...")
+    os.environ["SLIDES_BATCH_MAX_REQUESTS"] = "40"
+    try:
+        service, sent = make_fake_slides_service(fail_first_batch_with=http_error(503))
+        drive = MagicMock()
+        drive.files().get().execute.return_value = {"webViewLink": "https://slides/pres1"}
+        progress_calls = []
+
+        pres_id, link = create_slides_presentation(
+            service, drive, "Deck", json.dumps(make_outline(120)),
+            progress=lambda done, total, label: progress_calls.append((done, total))
+        )
+    finally:
+        del os.environ["SLIDES_BATCH_MAX_REQUESTS"]
+
+    batches = [b for b in sent if "requests" in b]
+    print(f"📊 Sent {len(batches)} batches, progress updates: {len(progress_calls)}")
+    assert (pres_id, link) == ("pres1", "https://slides/pres1")
+    assert "createSlide" in batches[0]["requests"][0]  # creation goes first
+    creation, text_groups = compile_slide_requests(make_outline(120), "Deck")
+    assert sum(len(b["requests"]) for b in batches) == len(creation) + 1 + sum(len(g) for g in text_groups)
+    creation_sent = [r for b in batches for r in b["requests"] if "insertText" not in r and "updateTextStyle" not in r]
+    assert creation_sent[-1] == {"deleteObject": {"objectId": "default_slide"}}  # after every createSlide
+    assert progress_calls[-1][0] == progress_calls[-1][1] == len(batches)
+    print("✅ SUCCESS: Failed batch retried on its own; progress reported per batch.")
+
+def test_parallel_text_batches_use_own_transport():
+    print("🧪 Testing Parallel Text Batches (per-thread AuthorizedHttp)...")
+    service, _ = make_fake_slides_service()
+    service._http = MagicMock()  # authorized transport with credentials -> parallel path
+    drive = MagicMock()
+    drive.files().get().execute.return_value = {"webViewLink": "https://slides/pres1"}
+    transports = []  # (thread that built it, transport)
+    calls = []       # (thread, http kwarg, is text batch)
+    lock = threading.Lock()
+
+    class FakeAuthorizedHttp:
+        def __init__(self, creds, http=None):
+            assert creds is service._http.credentials
+            with lock:
+                transports.append((threading.current_thread().name, self))
+
+    def batch_update(presentationId, body):
+        request = MagicMock()
+        def execute(**kwargs):
+            time.sleep(0.01)  # keep several workers busy at once
+            with lock:
+                calls.append((threading.current_thread().name, kwargs.get("http"), "insertText" in body["requests"][0]))
+            return {}
+        request.execute.side_effect = execute
+        return request
+    service.presentations().batchUpdate.side_effect = batch_update
+
+    with patch.dict(os.environ, {"SLIDES_BATCH_MAX_REQUESTS": "4", "SLIDES_BATCH_WORKERS": "4"}), \
+         patch("google_utils.AuthorizedHttp", FakeAuthorizedHttp):
+        assert create_slides_presentation(service, drive, "Deck", json.dumps(make_outline(30))) == ("pres1", "https://slides/pres1")
+
+    text_calls = [(thread, http) for thread, http, is_text in calls if is_text]
+    worker_threads = {thread for thread, _ in text_calls}
+    print(f"📊 {len(text_calls)} text batches on {len(worker_threads)} workers, {len(transports)} transports")
+    assert all(http is None for _, http, is_text in calls if not is_text)  # creation: shared transport
+    assert len(worker_threads) > 1 and all(t.startswith("slides") for t in worker_threads)
+    assert len(transports) == len(worker_threads)  # one transport per worker, built in that worker
+    owner = {id(http): thread for thread, http in transports}
+    assert all(owner[id(http)] == thread for thread, http in text_calls)
+    print("✅ SUCCESS: Text batches sent from worker threads, each on its own transport.")
+
+def test_failed_batches_resume_into_same_deck():
+    print("🧪 Testing Resume After Failed Text Batch (no second deck)...")
+    service, sent = make_fake_slides_service()
+    drive = MagicMock()
+    drive.files().get().execute.return_value = {"webViewLink": "https://slides/pres1"}
+    outline = json.dumps(make_outline(10))
+
+    def fail_text(presentationId, body):
+        request = MagicMock()
+        if "insertText" in body["requests"][0]:
+            request.execute.side_effect = http_error(503)
+        else:
+            sent.append(body)
+        return request
+
+    service.presentations().batchUpdate.side_effect = fail_text
+    with patch.dict(os.environ, {"SLIDES_BATCH_RETRIES": "1"}):
+        try:
+            create_slides_presentation(service, drive, "Deck", outline)
+            assert False, "expected SlidesBatchError"
+        except SlidesBatchError as e:
+            error = e
+    print(f"📊 Kept deck {error.presentation_id}, {len(error.pending_batches)} batch(es) pending")
+    assert error.presentation_id == "pres1" and error.pending_batches
+    creates = service.presentations().create.call_count
+
+    sent.clear()
+    service.presentations().batchUpdate.side_effect = None
+    service.presentations().batchUpdate.return_value.execute.return_value = {}
+    resume = {"presentation_id": error.presentation_id, "pending_batches": error.pending_batches}
+    assert create_slides_presentation(service, drive, "Deck", outline, resume=resume) == ("pres1", "https://slides/pres1")
+    assert service.presentations().create.call_count == creates  # no new presentation
+    resent = [c.kwargs["body"]["requests"] for c in service.presentations().batchUpdate.call_args_list[-len(error.pending_batches):]]
+    assert resent == error.pending_batches
+    print("✅ SUCCESS: Resume resent only the failed batches into the existing deck.")
+
+def test_ambiguous_failures_are_not_resent():
+    print("🧪 Testing Retry Only When Slides Rejected the Batch...")
+    for error, expected_calls in ((TimeoutError("timed out"), 1), (http_error(400), 1), (http_error(503), 3)):
+        service = MagicMock()
+        service.presentations().batchUpdate().execute.side_effect = error
+        service.presentations().batchUpdate.reset_mock()
+        with patch("google_utils.time.sleep"):
+            try:
+                google_utils._send_slides_batch(service, "pres1", [{"insertText": {"text": "Hi"}}], retries=3)
+                assert False, "expected the error to be raised"
+            except Exception as e:
+                assert e is error
+        calls = service.presentations().batchUpdate().execute.call_count
+        print(f"📊 {error!r}: sent {calls}x")
+        assert calls == expected_calls
+    print("✅ SUCCESS: Timeouts aren't resent (the text may already be there); 429/5xx are.")
+
+def test_invalid_outline_creates_no_deck():
+    print("🧪 Testing Invalid Outline (compiled before the deck is created)...")
+    service, _ = make_fake_slides_service()
+    drive = MagicMock()
+    pres_id, error = create_slides_presentation(service, drive, "Deck", json.dumps([{"title": "Cover"}, "not a slide"]))
+    print(f"📊 {error}")
+    assert pres_id is None and error.startswith("Invalid slide outline")
+    assert not service.presentations().create().execute.called
+    assert not drive.files().delete.called
+    print("✅ SUCCESS: Nothing created, nothing to clean up.")
+
+def test_failed_slide_creation_deletes_deck():
+    print("🧪 Testing Cleanup When Slide Creation Fails...")
+    service, _ = make_fake_slides_service()
+    service.presentations().batchUpdate.side_effect = RuntimeError("403 forbidden")
+    drive = MagicMock()
+    with patch.dict(os.environ, {"SLIDES_BATCH_RETRIES": "1"}):
+        pres_id, error = create_slides_presentation(service, drive, "Deck", json.dumps(make_outline(3)))
+    assert pres_id is None and "403" in error
+    drive.files().delete.assert_called_with(fileId="pres1")
+    print("✅ SUCCESS: Half-built deck deleted, nothing orphaned.")
+
+if __name__ == "__main__":
+    test_compile_single_pass()
+    test_chunk_bounds()
+    test_large_deck_with_retry_and_progress()
+    test_parallel_text_batches_use_own_transport()
+    test_failed_batches_resume_into_same_deck()
+    test_ambiguous_failures_are_not_resent()
+    test_invalid_outline_creates_no_deck()
+    test_failed_slide_creation_deletes_deck()
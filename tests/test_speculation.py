@@ -0,0 +1,101 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, MagicMock
+from streamlit.testing.v1 import AppTest
+from document_extractors import EXTRACTORS
+import google_utils
+import llm_helper
+import speculation
+from speculation import speculate_upload, take_preprocessed
+from llm_helper import normalize_text, estimate_tokens
+
+def test_normalize_and_estimate():
+    print("🧪 Testing Text Normalization & Token Estimate...")
+    text = normalize_text("  Hello   world \n\n\n\n  計算理論\t期末報告  ")
+    print(f"📥 Normalized: {text!r}")
+    assert text == "Hello world\n\n計算理論 期末報告"
+    assert estimate_tokens("計算理論") == 4
+    assert estimate_tokens("abcdefgh") == 2
+    print("✅ SUCCESS: Whitespace collapsed, CJK counted per character.")
+
+def test_preprocess_reused_on_submit():
+    print("🧪 Testing Speculative Extraction Reuse...")
+    state = {}
+    mock_extract = MagicMock(return_value="Assignment  text")
+    with patch.dict(EXTRACTORS, {".pdf": mock_extract}):
+        spec = speculate_upload(state, [("spec.pdf", b"pdf-1")])
+        assert speculate_upload(state, [("spec.pdf", b"pdf-1")]) is spec  # rerun with same file: no new work
+        result = take_preprocessed(state, [("spec.pdf", b"pdf-1")])
+        print(f"📊 Extraction calls: {mock_extract.call_count}")
+        assert "Assignment text" in result["text"]
+        assert mock_extract.call_count == 1
+
+        # Different file submitted: speculation is discarded and the new file extracted
+        take_preprocessed(state, [("spec.pdf", b"pdf-2")])
+        assert mock_extract.call_count == 2
+    print("✅ SUCCESS: Speculative result reused only for the same file.")
+
+def test_queued_speculation_extracted_inline():
+    print("🧪 Testing Submit While Speculation Is Still Queued...")
+    state = {}
+    release = threading.Event()
+    busy_pool = ThreadPoolExecutor(max_workers=1)
+    busy_pool.submit(release.wait, 10)  # other sessions' work occupies the only worker
+    mock_extract = MagicMock(return_value="Assignment text")
+    try:
+        with patch.object(speculation, "_executor", busy_pool), patch.dict(EXTRACTORS, {".pdf": mock_extract}):
+            spec = speculate_upload(state, [("spec.pdf", b"pdf-1")])
+            start = time.monotonic()
+            result = take_preprocessed(state, [("spec.pdf", b"pdf-1")])
+            elapsed = time.monotonic() - start
+    finally:
+        release.set()
+        busy_pool.shutdown()
+    print(f"📊 Took {elapsed:.2f}s, queued job cancelled: {spec.preprocessed.cancelled()}")
+    assert elapsed < 2 and "Assignment text" in result["text"]
+    assert spec.preprocessed.cancelled() and mock_extract.call_count == 1
+    print("✅ SUCCESS: Extracted inline instead of waiting for a free worker.")
+
+def test_upload_speculation_through_app():
+    print("🧪 Testing Speculation Through the App (upload -> fill form -> submit)...")
+    main_script = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src/main.py'))
+    preprocessed = {"text": "Assignment text", "tokens": 4, "sources": [{"name": "spec.txt", "tokens": 4, "error": None}]}
+    with tempfile.TemporaryDirectory() as tmp, \
+         patch.dict(os.environ, {"CHECKPOINT_DIR": tmp}), \
+         patch.object(speculation, "preprocess_documents", return_value=preprocessed) as mock_preprocess, \
+         patch.object(llm_helper, "warm_up_local_model"), \
+         patch.object(llm_helper, "generate_project_plan", return_value="PLAN") as mock_llm, \
+         patch.object(google_utils, "create_doc_with_content", return_value=("doc1", "https://docs/doc1")), \
+         patch.object(google_utils, "share_file_permissions", return_value=[]), \
+         patch.object(google_utils, "send_gmail", return_value=(["alice@example.com"], [])):
+        at = AppTest.from_file(main_script, default_timeout=30)
+        at.session_state["services"] = (MagicMock(), MagicMock(), MagicMock(), MagicMock())
+        at.run()
+
+        next(u for u in at.file_uploader if u.label.startswith("上傳作業說明")).set_value(("spec.txt", b"Assignment", "text/plain"))
+        at.run()
+        at.session_state["speculation"].preprocessed.result(timeout=10)
+        assert mock_llm.call_count == 0  # nothing generated before submit
+
+        at.text_input[0].set_value("Automata")
+        at.text_area[0].set_value("alice@example.com")
+        at.form_submit_button[0].click().run()
+
+        print(f"📊 Extractions: {mock_preprocess.call_count}, LLM calls: {mock_llm.call_count}")
+        assert not at.exception
+        assert any("所有流程執行完畢" in s.value for s in at.success)
+        assert mock_preprocess.call_count == 1  # speculative extraction reused on submit
+        assert mock_llm.call_count == 1
+        assert mock_llm.call_args[0][:3] == ("Automata", "alice@example.com", "Assignment text")
+    print("✅ SUCCESS: Upload extracted once in the background; one LLM call, with the submitted values.")
+
+if __name__ == "__main__":
+    test_normalize_and_estimate()
+    test_preprocess_reused_on_submit()
+    test_queued_speculation_extracted_inline()
+    test_upload_speculation_through_app()